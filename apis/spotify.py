@@ -1,5 +1,7 @@
-from exceptions import InvalidSpotifyURL, SpotifyAlbumNotFound, SpotifyTrackNotFound, SpotifyPlaylistNotFound, SpotifyRetrievalError
-import re
+from exceptions import SpotifyAlbumNotFound, SpotifyTrackNotFound, SpotifyPlaylistNotFound, SpotifyRetrievalError
+import asyncio
+import collections
+import datetime
 import os
 import sys
 
@@ -8,14 +10,31 @@ import login
 import tekore as tk
 
 import const
+from spotify_urls import parse_spotify_url, resource_url, sanitize_filename
+from transport import transport
 
 # Add the parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
+def timestamp_string(timestamp):
+    """Format a Spotify timestamp the way the Web API sends it, so stored timestamps compare in date order."""
+    if hasattr(timestamp, "strftime"):
+        return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    return str(timestamp)
+
+
+def timestamp_before(timestamp):
+    """The timestamp one second before a stored one, the smallest step they have."""
+    moment = datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+
+    return timestamp_string(moment - datetime.timedelta(seconds=1))
+
+
 class Spotify:
 
-    def __init__(self, authType: const.SpotifyAuthType):
+    def __init__(self, authType: const.SpotifyAuthType, cache=None, async_loading=False, page_concurrency=const.SPOTIFY_PAGE_CONCURRENCY):
         if authType == const.SpotifyAuthType.USER:
             token = login.get_user_token()
         else:
@@ -24,57 +43,161 @@ class Spotify:
         if token is None:
             raise ValueError('Error retrieving access token for user refresh token.')
 
-        self.tekore_spotify = tk.Spotify(token)
+        self.tekore_spotify = tk.Spotify(token, sender=transport.spotify_sender())
+        self.cache = cache
+        self.async_loading = async_loading
+        self.page_concurrency = page_concurrency
+
+    def load_tracks(self, track_ids):
+        """Load full tracks by ID, fetching up to SPOTIFY_TRACKS_BATCH_SIZE tracks per request."""
+        cached_metadata = self.cache.get_many("track", track_ids) if self.cache else {}
+        loaded_tracks = {track_id: self.track_from_metadata(track_metadata) for track_id, track_metadata in cached_metadata.items()}
+
+        missing_ids = [track_id for track_id in track_ids if track_id not in loaded_tracks]
+        fetched_tracks = []
+
+        for batch_start in range(0, len(missing_ids), const.SPOTIFY_TRACKS_BATCH_SIZE):
+            batch_ids = missing_ids[batch_start:batch_start + const.SPOTIFY_TRACKS_BATCH_SIZE]
+
+            try:
+                batch_tracks = self.tekore_spotify.tracks(batch_ids)
+            except tk.HTTPError as e:
+                raise SpotifyRetrievalError(f'Error retrieving tracks:{e}')
+
+            for track_data in batch_tracks:
+                # unavailable tracks come back as null
+                if track_data is None:
+                    continue
+
+                this_track = TrackRecord.from_tekore(track_data)
+                fetched_tracks.append(this_track)
+                loaded_tracks[track_data.id] = this_track
+
+        self.cache_tracks(fetched_tracks)
+
+        return [loaded_tracks[track_id] for track_id in track_ids if track_id in loaded_tracks]
+
+    def next_page(self, page):
+        """Fetch the page after a tekore paging object, or None after the last page."""
+        if not page.next:
+            return None
+
+        try:
+            return self.tekore_spotify.next(page)
+        except tk.HTTPError as e:
+            raise SpotifyRetrievalError(f'Error retrieving the next page of tracks:{e}')
+
+    def iter_pages(self, first_page, fetch_page):
+        """
+        Yield a tekore paging object and every page after it. In async loading mode the offsets of the remaining
+        pages are worked out from the first page's total and fetched concurrently with fetch_page(client, offset,
+        limit), a coroutine function making the request with an async tekore client. Otherwise they're followed
+        one at a time.
+        """
+        yield first_page
+
+        if self.async_loading:
+            yield from self.fetch_remaining_pages(first_page, fetch_page)
+            return
+
+        page = self.next_page(first_page)
+        while page is not None:
+            yield page
+            page = self.next_page(page)
+
+    def fetch_remaining_pages(self, first_page, fetch_page):
+        """
+        Yield the pages after first_page in order. At most page_concurrency requests are in flight: the next one
+        is sent as soon as the oldest has arrived, so only that many pages are ever held in memory and the first
+        of them can be downloading while the rest are still on their way.
+        """
+        offsets = iter(range(first_page.offset + first_page.limit, first_page.total, first_page.limit))
+
+        # one event loop and one connection pool for the whole collection, the loop only runs while a page is awaited
+        loop = asyncio.new_event_loop()
+        http_client = transport.async_spotify_client()
+        async_spotify = tk.Spotify(self.tekore_spotify.token, sender=transport.async_spotify_sender(http_client))
+        pending = collections.deque()
+
+        def request_pages():
+            while len(pending) < self.page_concurrency:
+                offset = next(offsets, None)
+                if offset is None:
+                    return
+
+                pending.append(loop.create_task(fetch_page(async_spotify, offset, first_page.limit)))
+
+        try:
+            request_pages()
+
+            while pending:
+                # requests still go through the rate limiter, which also holds them back after a 429
+                try:
+                    page = loop.run_until_complete(pending.popleft())
+                except tk.HTTPError as e:
+                    raise SpotifyRetrievalError(f'Error retrieving the next page of tracks:{e}')
+
+                request_pages()
+                yield page
+        finally:
+            # the collection failed or was only partly read, don't leave requests behind
+            for task in pending:
+                task.cancel()
 
-    def likedSongs(self):
-        return SpotifyLikedSongs(self)
+            if pending:
+                loop.run_until_complete(asyncio.wait(pending))
 
+            loop.run_until_complete(http_client.aclose())
+            loop.close()
+
+    def track_from_metadata(self, track_metadata):
+        """Rebuild a track from metadata previously returned by TrackRecord.get_metadata()."""
+        return TrackRecord.from_metadata(track_metadata)
+
+    def cache_tracks(self, tracks):
+        if self.cache and tracks:
+            self.cache.set_many("track", [(this_track.resource_id, this_track.get_metadata()) for this_track in tracks])
+
+    def likedSongs(self, incremental=False):
+        return SpotifyLikedSongs(self, incremental)
+
+    # each accepts an open.spotify.com URL, a spotify: URI or a bare ID, and raises InvalidSpotifyURL otherwise
     def playlist(self, playlist_url):
-        if not re.match(r"https://open\.spotify\.com/playlist/[A-Za-z0-9?=\-]+", playlist_url):
-            raise InvalidSpotifyURL(
-                f"Invalid Spotify Playlist URL: {playlist_url}")
-        return SpotifyPlaylist(self, playlist_url)
+        (_, resource_id) = parse_spotify_url(playlist_url, "playlist")
+        return SpotifyPlaylist(self, resource_id)
 
     def track(self, track_url):
-        if not re.match(r"https://open\.spotify\.com/track/[A-Za-z0-9?=\-]+", track_url):
-            raise InvalidSpotifyURL(f"Invalid Spotify Track URL: {track_url}")
-        return SpotifyTrack(self, track_url)
+        (_, resource_id) = parse_spotify_url(track_url, "track")
+        return SpotifyTrack(self, resource_id).load()
 
     def album(self, album_url):
-        if not re.match(r"https://open\.spotify\.com/album/[A-Za-z0-9?=\-]+", album_url):
-            raise InvalidSpotifyURL(f"Invalid Spotify Album URL: {album_url}")
-        return SpotifyAlbum(self, album_url)
+        (_, resource_id) = parse_spotify_url(album_url, "album")
+        return SpotifyAlbum(self, resource_id)
 
 class SpotifyPlaylist():
-    def __init__(self, base: Spotify, resource_url):
+    def __init__(self, base: Spotify, resource_id):
         self.base = base
-        self.resource_url = resource_url
-        self.resource_id_match = re.search(
-            r"/playlist/([a-zA-Z0-9]+)", self.resource_url)
-        self.resource_id = self.resource_id_match.group(1)
+        self.resource_id = resource_id
+        self.resource_url = resource_url("playlist", resource_id)
         self.playlist_metadata = {}
 
     def load(self):
+        """Fetch the playlist and its first page of tracks. The rest are only paged by iter_tracks()."""
 
         try:
             playlist = self.base.tekore_spotify.playlist(self.resource_id)
-            
-            # handles spotify API paging internally
-            playlist_tracks = self.base.tekore_spotify.all_items(playlist.tracks)
-            tracks = []
-
-            for model in playlist_tracks:
-                external_urls = model.track.external_urls
-
-                this_track = SpotifyTrack(self.base, external_urls.get("spotify", ""))
-                this_track.load(model.track)
-                tracks.append(this_track)
 
             if playlist:
+                # the snapshot id changes whenever the playlist does, so a matching cache entry is still accurate
+                cached_playlist = self.base.cache.get("playlist", self.resource_id, version=playlist.snapshot_id) if self.base.cache else None
+
                 self.playlist_metadata = {
                     "title": playlist.name,
                     "image_url": playlist.images[0].url if len(playlist.images) > 0 else const.UNKNOWN_ALBUM_COVER_URL,
-                    "tracks": tracks,
+                    "snapshot_id": playlist.snapshot_id,
+                    "total": len(cached_playlist["tracks"]) if cached_playlist else playlist.tracks.total,
+                    "cached_tracks": cached_playlist["tracks"] if cached_playlist else None,
+                    "first_page": playlist.tracks,
                 }
             else:
                 raise SpotifyPlaylistNotFound(
@@ -86,6 +209,47 @@ class SpotifyPlaylist():
             
             raise SpotifyRetrievalError(f'Error retrieving playlist:{e}')
 
+    def iter_tracks(self):
+        """Yield the playlist's tracks page by page, so that downloading can start before a large playlist is paged."""
+
+        if not self.playlist_metadata:
+            self.load()
+
+        if self.playlist_metadata["cached_tracks"] is not None:
+            for track_metadata in self.playlist_metadata["cached_tracks"]:
+                yield self.base.track_from_metadata(track_metadata)
+            return
+
+        tracks_metadata = []
+
+        for page in self.base.iter_pages(self.playlist_metadata["first_page"], self.fetch_page):
+            for model in page.items:
+                # local files and tracks removed from Spotify have no track
+                if model.track is None:
+                    continue
+
+                this_track = TrackRecord.from_tekore(model.track)
+
+                if self.base.cache:
+                    tracks_metadata.append(this_track.get_metadata())
+
+                yield this_track
+
+        # only a playlist that was paged to the end is cached
+        if self.base.cache:
+            self.base.cache.set("playlist", self.resource_id, {"tracks": tracks_metadata}, version=self.playlist_metadata["snapshot_id"])
+
+    async def fetch_page(self, async_spotify, offset, limit):
+        return await async_spotify.playlist_items(self.resource_id, offset=offset, limit=limit)
+
+    def get_total(self):
+        """Number of tracks in the playlist, known from the first page."""
+
+        if not self.playlist_metadata:
+            self.load()
+
+        return self.playlist_metadata["total"]
+
     def get_title(self, sanitize=False):
 
         if not self.playlist_metadata:
@@ -97,13 +261,7 @@ class SpotifyPlaylist():
         if not sanitize:
             return playlist_title
         else:
-            return "".join(
-                [
-                    current_character
-                    for current_character in playlist_title
-                    if current_character in const.LEGAL_PATH_CHARACTERS
-                ]
-            )
+            return sanitize_filename(playlist_title)
 
     def get_cover_art_url(self):
 
@@ -120,7 +278,10 @@ class SpotifyPlaylist():
         if not self.playlist_metadata:
             self.load()
 
-        return self.playlist_metadata.get("tracks", [])
+        if "tracks" not in self.playlist_metadata:
+            self.playlist_metadata["tracks"] = list(self.iter_tracks())
+
+        return self.playlist_metadata["tracks"]
 
     def get_metadata(self):
 
@@ -131,34 +292,36 @@ class SpotifyPlaylist():
 
 
 class SpotifyAlbum():
-    def __init__(self, base: Spotify, resource_url):
+    def __init__(self, base: Spotify, resource_id):
         self.base = base
-        self.resource_url = resource_url
-        self.resource_id_match = re.search(
-            r"/album/([a-zA-Z0-9]+)", self.resource_url)
-        self.resource_id = self.resource_id_match.group(1)
+        self.resource_id = resource_id
+        self.resource_url = resource_url("album", resource_id)
         self.album_metadata = {}
 
     def load(self):
+        """Fetch the album and its first page of tracks. The rest are only paged by iter_tracks()."""
 
-        try:
-            album = self.base.tekore_spotify.album(self.resource_id)
-            # handles spotify API paging internally
-            album_tracks = self.base.tekore_spotify.all_items(album.tracks)
-            tracks = []
+        cached_album = self.base.cache.get("album", self.resource_id) if self.base.cache else None
 
-            for model in album_tracks:
-                external_urls = model.external_urls
+        if cached_album:
+            self.album_metadata = {
+                "title": cached_album["title"],
+                "image_url": cached_album["image_url"],
+                "total": len(cached_album["tracks"]),
+                "cached_tracks": cached_album["tracks"],
+            }
+            return
 
-                this_track = SpotifyTrack(self.base, external_urls.get("spotify", ""))
-                this_track.load()
-                tracks.append(this_track)
+        try:
+            album = self.base.tekore_spotify.album(self.resource_id)
 
             if album:
                 self.album_metadata = {
                     "title": album.name,
                     "image_url": album.images[0].url if len(album.images) > 0 else const.UNKNOWN_ALBUM_COVER_URL,
-                    "tracks": tracks,
+                    "total": album.tracks.total,
+                    "cached_tracks": None,
+                    "first_page": album.tracks,
                 }
             else:
                 raise SpotifyAlbumNotFound(
@@ -167,6 +330,45 @@ class SpotifyAlbum():
         except tk.HTTPError as e:
             raise SpotifyRetrievalError(f'Error retrieving album:{e}')
 
+    def iter_tracks(self):
+        """Yield the album's tracks page by page, so that downloading can start before a long album is paged."""
+
+        if not self.album_metadata:
+            self.load()
+
+        if self.album_metadata["cached_tracks"] is not None:
+            for track_metadata in self.album_metadata["cached_tracks"]:
+                yield self.base.track_from_metadata(track_metadata)
+            return
+
+        tracks_metadata = []
+
+        for page in self.base.iter_pages(self.album_metadata["first_page"], self.fetch_page):
+            # album tracks are simplified models, so hydrate each page with a single batch request
+            for this_track in self.base.load_tracks([model.id for model in page.items if model.id]):
+                if self.base.cache:
+                    tracks_metadata.append(this_track.get_metadata())
+
+                yield this_track
+
+        if self.base.cache:
+            self.base.cache.set("album", self.resource_id, {
+                "title": self.album_metadata["title"],
+                "image_url": self.album_metadata["image_url"],
+                "tracks": tracks_metadata,
+            })
+
+    async def fetch_page(self, async_spotify, offset, limit):
+        return await async_spotify.album_tracks(self.resource_id, offset=offset, limit=limit)
+
+    def get_total(self):
+        """Number of tracks on the album, known from the first page."""
+
+        if not self.album_metadata:
+            self.load()
+
+        return self.album_metadata["total"]
+
     def get_title(self, sanitize=False):
 
         if not self.album_metadata:
@@ -177,13 +379,7 @@ class SpotifyAlbum():
         if not sanitize:
             return album_title
         else:
-            return "".join(
-                [
-                    current_character
-                    for current_character in album_title
-                    if current_character in const.LEGAL_PATH_CHARACTERS
-                ]
-            )
+            return sanitize_filename(album_title)
 
     def get_cover_art_url(self):
 
@@ -197,7 +393,10 @@ class SpotifyAlbum():
         if not self.album_metadata:
             self.load()
 
-        return self.album_metadata.get("tracks", [])
+        if "tracks" not in self.album_metadata:
+            self.album_metadata["tracks"] = list(self.iter_tracks())
+
+        return self.album_metadata["tracks"]
 
     def get_metadata(self):
 
@@ -208,155 +407,330 @@ class SpotifyAlbum():
 
 
 class SpotifyTrack():
-    def __init__(self, base: Spotify, resource_url):
+    """A track requested by its ID. load() reads it from the cache or fetches it, returning a TrackRecord."""
+    def __init__(self, base: Spotify, resource_id):
         self.base = base
-        self.resource_url = resource_url
-        self.resource_id_match = re.search(
-            r"/track/([a-zA-Z0-9]+)", self.resource_url)
-        self.resource_id = self.resource_id_match.group(1)
-        self.track_metadata = {}
+        self.resource_id = resource_id
+        self.resource_url = resource_url("track", resource_id)
 
-    def load(self, track_data=None):
+    def load(self):
 
-        if track_data == None:
+        cached_metadata = self.base.cache.get("track", self.resource_id) if self.base.cache else None
+        if cached_metadata:
+            return TrackRecord.from_metadata(cached_metadata)
 
-            try:
-                track_data = self.base.tekore_spotify.track(self.resource_id)
-            except tk.HTTPError as e:
-                raise SpotifyRetrievalError(f'Error retrieving track:{e}')
-
-        if track_data:
-
-            album_data = track_data.album
-            artists_data = track_data.artists
-            external_urls = track_data.external_urls
-            album_images = album_data.images
-
-            self.track_metadata = {
-                "title": track_data.name,
-                "artist": [artist.name for artist in artists_data],
-                "album": album_data.name,
-                "release_date": album_data.release_date,
-                "track_num": track_data.track_number,
-                "disc_num": track_data.disc_number,
-                "isrc": track_data.external_ids.get("isrc", False),
-                "comments": {
-                    "Spotify Track URL": external_urls.get("spotify", ""),
-                    "Spotify Album URL": album_data.external_urls.get("spotify", ""),
-                    "Spotify Artist URL": artists_data[0].external_urls.get("spotify", ""),
-                    "Duration (ms)": str(track_data.duration_ms),
-                    "Album Type": album_data.album_type,
-                },
-                "image_url": album_images[0].url if len(album_images) > 0 else const.UNKNOWN_ALBUM_COVER_URL,
-            }
+        try:
+            track_data = self.base.tekore_spotify.track(self.resource_id)
+        except tk.HTTPError as e:
+            raise SpotifyRetrievalError(f'Error retrieving track:{e}')
 
-        else:
+        if not track_data:
             raise SpotifyTrackNotFound(
                 "Failed to fetch track data from Spotify API.")
 
-    def get_title(self, sanitize=False):
-
-        if not self.track_metadata:
-            self.load()
+        this_track = TrackRecord.from_tekore(track_data)
+        self.base.cache_tracks([this_track])
+
+        return this_track
+
+
+class TrackRecord():
+    """
+    A loaded Spotify track. Records are slotted and immutable, hold no reference back to the client, and work out
+    their file name and search strings once. Strings shared by the tracks of an album are interned, so a library of
+    tens of thousands of tracks holds each album name and cover URL once.
+    """
+    __slots__ = (
+        "resource_id", "title", "artists", "album", "release_date", "track_num", "disc_num", "isrc",
+        "track_url", "album_url", "artist_url", "duration_ms", "album_type", "image_url",
+        "artist", "sanitized_title", "sanitized_artist", "searchable_title",
+    )
+
+    def __init__(self, resource_id, title, artists, album, release_date, track_num, disc_num, isrc,
+                 track_url, album_url, artist_url, duration_ms, album_type, image_url):
+        artists = tuple(sys.intern(artist) for artist in artists)
+        artist = " ".join(artists)
+
+        fields = {
+            "resource_id": resource_id,
+            "title": title,
+            "artists": artists,
+            "album": sys.intern(album or ""),
+            "release_date": sys.intern(release_date or ""),
+            "track_num": track_num,
+            "disc_num": disc_num,
+            "isrc": isrc or None,
+            "track_url": track_url,
+            "album_url": sys.intern(album_url or ""),
+            "artist_url": sys.intern(artist_url or ""),
+            "duration_ms": duration_ms,
+            "album_type": sys.intern(album_type or ""),
+            "image_url": sys.intern(image_url or ""),
+            "artist": artist,
+            "sanitized_title": sanitize_filename(title),
+            "sanitized_artist": sanitize_filename(artist),
+            "searchable_title": title + " - " + artist,
+        }
+
+        for (name, value) in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"TrackRecord is immutable, can't set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"TrackRecord is immutable, can't delete {name}")
+
+    def __repr__(self):
+        return f"TrackRecord({self.resource_id!r}, {self.searchable_title!r})"
+
+    @classmethod
+    def from_tekore(cls, track_data):
+        album_data = track_data.album
+        artists_data = track_data.artists
+        album_images = album_data.images
+
+        return cls(
+            resource_id=track_data.id,
+            title=track_data.name,
+            artists=[artist.name for artist in artists_data],
+            album=album_data.name,
+            release_date=album_data.release_date,
+            track_num=track_data.track_number,
+            disc_num=track_data.disc_number,
+            isrc=track_data.external_ids.get("isrc"),
+            track_url=track_data.external_urls.get("spotify", ""),
+            album_url=album_data.external_urls.get("spotify", ""),
+            artist_url=artists_data[0].external_urls.get("spotify", ""),
+            duration_ms=track_data.duration_ms,
+            album_type=str(album_data.album_type),
+            image_url=album_images[0].url if len(album_images) > 0 else const.UNKNOWN_ALBUM_COVER_URL,
+        )
 
-        track_title = self.track_metadata.get("title", "Unknown Title")
+    @classmethod
+    def from_metadata(cls, track_metadata):
+        """Rebuild a track from metadata previously returned by get_metadata() (e.g. read from the cache)."""
+        comments = track_metadata["comments"]
+        duration_ms = str(comments.get("Duration (ms)", ""))
+
+        return cls(
+            resource_id=track_metadata["id"],
+            title=track_metadata["title"],
+            artists=track_metadata["artist"],
+            album=track_metadata["album"],
+            release_date=track_metadata["release_date"],
+            track_num=track_metadata["track_num"],
+            disc_num=track_metadata["disc_num"],
+            isrc=track_metadata.get("isrc"),
+            track_url=comments["Spotify Track URL"],
+            album_url=comments.get("Spotify Album URL", ""),
+            artist_url=comments.get("Spotify Artist URL", ""),
+            duration_ms=int(duration_ms) if duration_ms.isdigit() else None,
+            album_type=comments.get("Album Type", ""),
+            image_url=track_metadata.get("image_url", const.UNKNOWN_ALBUM_COVER_URL),
+        )
 
-        if not sanitize:
-            return track_title
-        else:
-            return "".join(
-                [
-                    current_character
-                    for current_character in track_title
-                    if current_character in const.LEGAL_PATH_CHARACTERS
-                ]
-            )
+    def get_title(self, sanitize=False):
+        return self.sanitized_title if sanitize else self.title
 
     def get_artist(self, sanitize=False):
-
-        if not self.track_metadata:
-            self.load()
-
-        artist_name = " ".join(
-            self.track_metadata.get("artist", "Unknown artist"))
-
-        if not sanitize:
-            return artist_name
-
-        else:
-            return "".join(
-                [
-                    current_character
-                    for current_character in artist_name
-                    if current_character in const.LEGAL_PATH_CHARACTERS
-                ]
-            )
+        return self.sanitized_artist if sanitize else self.artist
 
     def get_searchable_title(self):
-
-        if not self.track_metadata:
-            self.load()
-
-        searchable_title = (
-            self.track_metadata.get("title", "Unknown Title")
-            + " - "
-            + " ".join(self.track_metadata.get("artist"))
-        )
-
-        return searchable_title
+        return self.searchable_title
 
     def get_cover_art_url(self):
-
-        if not self.track_metadata:
-            self.load()
-
-        cover_art_url = self.track_metadata.get(
-            "image_url", const.UNKNOWN_ALBUM_COVER_URL)
-
-        return cover_art_url
+        return self.image_url
 
     def get_metadata(self):
-
-        if not self.track_metadata:
-            self.load()
-
-        return self.track_metadata
+        """The track as the metadata dict the tag writers and the cache use. Built on each call, nothing keeps it."""
+        return {
+            "id": self.resource_id,
+            "title": self.title,
+            "artist": list(self.artists),
+            "album": self.album,
+            "release_date": self.release_date,
+            "track_num": self.track_num,
+            "disc_num": self.disc_num,
+            "isrc": self.isrc or False,
+            "comments": {
+                "Spotify Track URL": self.track_url,
+                "Spotify Album URL": self.album_url,
+                "Spotify Artist URL": self.artist_url,
+                "Duration (ms)": str(self.duration_ms),
+                "Album Type": self.album_type,
+            },
+            "image_url": self.image_url,
+        }
 
 
 class SpotifyLikedSongs():
-    def __init__(self, base: Spotify):
+    def __init__(self, base: Spotify, incremental=False):
         self.base = base
+        self.incremental = incremental
+        self.user_id = None
+        self.newest_added_at = None
+        self.added_at = {}
+        self.paged_to_end = False
         self.playlist_metadata = {}
 
     def load(self):
+        """Fetch the first page of saved tracks. The rest are only paged by iter_tracks()."""
 
         try:
             playlist = self.base.tekore_spotify.saved_tracks(limit=50)
-            # handles spotify API paging internally
-            playlist_tracks = self.base.tekore_spotify.all_items(playlist)
-            tracks = []
 
-            for model in playlist_tracks:
-                external_urls = model.track.external_urls
+            if playlist:
+                user = self.base.tekore_spotify.current_user()
+                self.user_id = user.id
 
-                this_track = SpotifyTrack(self.base, external_urls.get("spotify", ""))
-                this_track.load(model.track)
-                tracks.append(this_track)
+                if len(playlist.items) > 0:
+                    self.newest_added_at = timestamp_string(playlist.items[0].added_at)
 
-            if playlist:
-                images = self.base.tekore_spotify.current_user().images
+                sync_point = self.get_sync_point() if self.incremental else None
+
+                images = user.images
                 self.playlist_metadata = {
                     "title": "Liked Songs",
                     "image_url": images[0].url if len(images) > 0 else const.UNKNOWN_ALBUM_COVER_URL,
-                    "tracks": tracks,
+                    "total": playlist.total,
+                    "first_page": playlist,
                 }
+
+                # an incremental sync usually only has a handful of new songs, so they're paged straight away to count them
+                if sync_point:
+                    self.playlist_metadata["tracks"] = list(self.iter_saved_tracks_since(playlist, sync_point))
+                    self.playlist_metadata["total"] = len(self.playlist_metadata["tracks"])
             else:
                 raise SpotifyPlaylistNotFound(
                     "Failed to fetch playlist data from Spotify API.")
 
         except tk.HTTPError:
             raise SpotifyRetrievalError("Error in retrieving playlist!")
-        
+
+    def iter_tracks(self):
+        """Yield the saved tracks page by page, newest first, so that downloading can start before a large library is paged."""
+
+        if not self.playlist_metadata:
+            self.load()
+
+        if "tracks" in self.playlist_metadata:
+            yield from self.playlist_metadata["tracks"]
+        else:
+            yield from self.iter_saved_tracks(self.playlist_metadata["first_page"], self.user_id)
+
+        self.paged_to_end = True
+
+    def get_total(self):
+        """Number of saved tracks (or of tracks saved since the last incremental sync), known from the first page."""
+
+        if not self.playlist_metadata:
+            self.load()
+
+        return self.playlist_metadata["total"]
+
+    def iter_saved_tracks(self, first_page, user_id):
+        """
+        Saved tracks come back newest first, so with a cached copy of the library only the saves newer than the
+        cached ones need to be paged. The whole library is paged again if songs were removed since it was cached,
+        skipping the songs that were already yielded.
+        """
+        cached_entry = self.base.cache.get_entry("liked", user_id) if self.base.cache else None
+        cached_items = cached_entry[2]["items"] if cached_entry else []
+
+        new_items = []
+        yielded_items = set()
+        reached_cached_items = False
+
+        if cached_items:
+            newest_cached_item = (cached_items[0]["id"], cached_items[0]["added_at"])
+            page = first_page
+
+            while page is not None and not reached_cached_items:
+                for model in page.items:
+                    if (model.track.id, timestamp_string(model.added_at)) == newest_cached_item:
+                        reached_cached_items = True
+                        break
+
+                    item = self.saved_track_entry(model)
+                    new_items.append(item)
+                    yielded_items.add((item["id"], item["added_at"]))
+                    self.added_at[item["id"]] = item["added_at"]
+
+                    yield self.base.track_from_metadata(item["track"])
+
+                if not reached_cached_items:
+                    page = self.base.next_page(page)
+
+        if reached_cached_items and len(new_items) + len(cached_items) == first_page.total:
+            items = new_items + cached_items
+
+            for item in cached_items:
+                self.added_at[item["id"]] = item["added_at"]
+                yield self.base.track_from_metadata(item["track"])
+        else:
+            items = []
+
+            for page in self.base.iter_pages(first_page, self.fetch_page):
+                for model in page.items:
+                    item = self.saved_track_entry(model)
+                    items.append(item)
+
+                    if (item["id"], item["added_at"]) not in yielded_items:
+                        self.added_at[item["id"]] = item["added_at"]
+                        yield self.base.track_from_metadata(item["track"])
+
+        if self.base.cache and (new_items or not reached_cached_items):
+            self.base.cache.set("liked", user_id, {"items": items})
+
+    async def fetch_page(self, async_spotify, offset, limit):
+        return await async_spotify.saved_tracks(offset=offset, limit=limit)
+
+    def iter_saved_tracks_since(self, first_page, sync_point):
+        """Page saved tracks (newest first) only until reaching one saved at or before the sync point."""
+        page = first_page
+
+        while page is not None:
+            for model in page.items:
+                added_at = timestamp_string(model.added_at)
+                if added_at <= sync_point:
+                    return
+
+                self.added_at[model.track.id] = added_at
+                yield TrackRecord.from_tekore(model.track)
+
+            page = self.base.next_page(page)
+
+    def saved_track_entry(self, model):
+        return {
+            "id": model.track.id,
+            "added_at": timestamp_string(model.added_at),
+            "track": TrackRecord.from_tekore(model.track).get_metadata(),
+        }
+
+    def get_sync_point(self):
+        """Return when the newest song handled by the last incremental sync was saved, or None before the first sync."""
+        if not self.base.cache:
+            return None
+
+        entry = self.base.cache.get_entry("liked_sync", self.user_id)
+
+        return entry[2]["added_at"] if entry else None
+
+    def save_sync_point(self, failed_track_ids=()):
+        """
+        Remember the newest saved song so the next incremental sync stops paging there. With songs that failed, the
+        sync point only moves up to just before the oldest of them, so the next sync tries them again. Nothing is
+        saved if the songs weren't paged to the end, the older ones among them weren't handled.
+        """
+        if not (self.base.cache and self.user_id and self.newest_added_at and self.paged_to_end):
+            return
+
+        failed_added_at = [self.added_at[track_id] for track_id in failed_track_ids if track_id in self.added_at]
+        sync_point = timestamp_before(min(failed_added_at)) if failed_added_at else self.newest_added_at
+
+        self.base.cache.set("liked_sync", self.user_id, {"added_at": sync_point})
+
     def get_title(self, sanitize=False):
 
         if not self.playlist_metadata:
@@ -368,20 +742,17 @@ class SpotifyLikedSongs():
         if not sanitize:
             return playlist_title
         else:
-            return "".join(
-                [
-                    current_character
-                    for current_character in playlist_title
-                    if current_character in const.LEGAL_PATH_CHARACTERS
-                ]
-            )
+            return sanitize_filename(playlist_title)
 
     def get_tracks(self):
 
         if not self.playlist_metadata:
             self.load()
 
-        return self.playlist_metadata.get("tracks", [])
+        if "tracks" not in self.playlist_metadata:
+            self.playlist_metadata["tracks"] = list(self.iter_tracks())
+
+        return self.playlist_metadata["tracks"]
 
 
 if __name__ == "__main__":
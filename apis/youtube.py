@@ -1,61 +1,169 @@
-import sys
 import os
-import shutil
 import time
-import string
-from pathlib import Path
-import ssl
 import re
 import json
+import urllib.error
+import urllib.parse
+import threading
 
-from const import colours
+from const import colours, STREAM_CHUNK_SIZE, MATCH_ISRC_MIN_SCORE
 from pytubefix import YouTube as pytubeYouTube
 from youtube_search import YoutubeSearch
-from exceptions import SpotifyAlbumNotFound, SpotifyTrackNotFound, SpotifyPlaylistNotFound, ConfigVideoMaxLength, ConfigVideoLowViewCount, YoutubeItemNotFound
-from apis.spotify import Spotify
-from utils import resave_audio_clip_with_metadata
+from transport import transport
+from ratelimit import rate_limiter, backoff_delay, is_throttled
+from metrics import run_metrics
+from matching import MatchTarget, rank_candidates
+from exceptions import ConfigVideoMaxLength, ConfigVideoLowViewCount, YoutubeItemNotFound
 
-ssl._create_default_https_context = ssl._create_stdlib_context
+class PooledYoutubeSearch(YoutubeSearch):
+    """YoutubeSearch that loads its results page through the shared session instead of a new connection per query."""
+    def _search(self):
+        encoded_search = urllib.parse.quote_plus(self.search_terms)
+        url = f"https://www.youtube.com/results?search_query={encoded_search}"
+
+        response = transport.session().get(url).text
+
+        # YouTube occasionally serves a page without the embedded results
+        attempts = 1
+        while "ytInitialData" not in response and attempts < 3:
+            run_metrics.add_retry()
+            response = transport.session().get(url).text
+            attempts += 1
+
+        results = self._parse_html(response)
+
+        if self.max_results is not None and len(results) > self.max_results:
+            return results[: self.max_results]
+
+        return results
+
+def get_video_id(youtube_link):
+    """Return the video id of a youtube.com/watch?v= link, or None if it doesn't have one."""
+    query = urllib.parse.urlparse(youtube_link).query
+    return urllib.parse.parse_qs(query).get("v", [None])[0]
+
+def get_track_isrc(track):
+    return track.isrc if track is not None else None
 
 class YouTube:
-    def __init__(self):
-        pass
+    def __init__(self, match_cache=None):
+        self.match_cache = match_cache
+        self.match_stats = {"cache_hits": 0, "isrc_hits": 0, "isrc_misses": 0, "text_searches": 0}
+        self.match_stats_lock = threading.Lock()
+        self.download_locks = {}
+        self.download_locks_lock = threading.Lock()
 
-    def search(self, search_query, max_length, min_view_count, search_count=5):
-        youtube_results = YoutubeSearch(search_query, max_results=search_count).to_json()
+    def search(self, search_query, max_length, min_view_count, search_count=5, track=None):
+        match_keys = self.get_match_keys(search_query, track)
 
-        if len(json.loads(youtube_results)['videos']) < 1:
-            raise YoutubeItemNotFound('Skipped song -- Could not load from YouTube')
+        cached_match = self.match_cache.get(match_keys) if self.match_cache else None
 
-        youtube_videos = json.loads(youtube_results)['videos']
-        videos_meta = []
+        if cached_match:
+            self.count_match("cache_hits")
+            youtube_video_link = "https://www.youtube.com/watch?v=" + cached_match["video_id"]
+            self.check_video_limits(youtube_video_link, cached_match["duration"], cached_match["views"], max_length, min_view_count)
+            return youtube_video_link
 
-        for video in youtube_videos:
-            youtube_video_duration = video['duration'].split(':')
-            if len(youtube_video_duration) == 3:  # Format: HH:MM:SS
-                youtube_video_duration_seconds = int(youtube_video_duration[0]) * 3600 + int(youtube_video_duration[1]) * 60 + int(youtube_video_duration[2])
-            else:  # Format: MM:SS
-                youtube_video_duration_seconds = int(youtube_video_duration[0]) * 60 + int(youtube_video_duration[1])
+        target = MatchTarget.from_track(track) if track is not None else MatchTarget.from_query(search_query)
+        chosen_video = None
 
-            youtube_video_views = re.sub('[^0-9]', '', video['views'])
-            youtube_video_viewcount_safe = int(youtube_video_views) if youtube_video_views.isdigit() else 0
+        # official uploads usually carry the recording's ISRC in their description, so it's a far more specific query than the title
+        isrc = get_track_isrc(track)
+        if isrc:
+            chosen_video = self.search_isrc(isrc, target, max_length, min_view_count, search_count)
+            self.count_match("isrc_hits" if chosen_video else "isrc_misses")
 
-            videos_meta.append((video, youtube_video_duration_seconds, youtube_video_viewcount_safe))
+        if chosen_video is None:
+            self.count_match("text_searches")
+            candidates = rank_candidates(self.search_videos(search_query, search_count), target)
 
-        sorted_videos = sorted(videos_meta, key=lambda vid: vid[2], reverse=True)
-        chosen_video = sorted_videos[0]
+            if len(candidates) < 1:
+                raise YoutubeItemNotFound('Skipped song -- Could not load from YouTube')
 
-        youtube_video_link = "https://www.youtube.com" + chosen_video[0]['url_suffix']
+            chosen_video = self.pick_candidate(candidates, max_length, min_view_count)
 
-        if chosen_video[1] >= max_length:
-            raise ConfigVideoMaxLength(f'Length {chosen_video[1]}s exceeds MAX_LENGTH value of {max_length}s [{youtube_video_link}]')
+        youtube_video_link = "https://www.youtube.com" + chosen_video.url_suffix
 
-        if chosen_video[2] <= min_view_count:
-            raise ConfigVideoLowViewCount(f'View count {chosen_video[2]} does not meet MIN_VIEW_COUNT value of {min_view_count} [{youtube_video_link}]')
+        if self.match_cache:
+            self.match_cache.set(match_keys, get_video_id(youtube_video_link), chosen_video.title, chosen_video.duration, chosen_video.views)
 
         return youtube_video_link
 
-    def download(self, url, audio_bitrate):
+    def search_videos(self, search_query, search_count):
+        youtube_results = PooledYoutubeSearch(search_query, max_results=search_count).to_json()
+        return json.loads(youtube_results)['videos']
+
+    def search_isrc(self, isrc, target, max_length, min_view_count, search_count):
+        """Search YouTube for a recording's ISRC, returning the best confident match within the limits or None."""
+        candidates = [
+            candidate for candidate in rank_candidates(self.search_videos(f'"{isrc}"', search_count), target)
+            if candidate.score >= MATCH_ISRC_MIN_SCORE
+        ]
+
+        try:
+            return self.pick_candidate(candidates, max_length, min_view_count) if candidates else None
+        except (ConfigVideoMaxLength, ConfigVideoLowViewCount):
+            return None
+
+    def pick_candidate(self, candidates, max_length, min_view_count):
+        """Take the best scoring video within the limits, if none are raise why the best one was rejected."""
+        rejection = None
+
+        for candidate in candidates:
+            try:
+                self.check_video_limits("https://www.youtube.com" + candidate.url_suffix, candidate.duration, candidate.views, max_length, min_view_count)
+            except (ConfigVideoMaxLength, ConfigVideoLowViewCount) as e:
+                rejection = rejection or e
+                continue
+
+            return candidate
+
+        raise rejection
+
+    def count_match(self, outcome):
+        with self.match_stats_lock:
+            self.match_stats[outcome] += 1
+
+    def format_match_stats(self):
+        """One line summary of how this run's tracks were matched, or None if nothing was searched for."""
+        with self.match_stats_lock:
+            stats = dict(self.match_stats)
+
+        if not any(stats.values()):
+            return None
+
+        return (f"{stats['cache_hits']} from the match cache, {stats['isrc_hits']} by ISRC "
+                f"({stats['isrc_misses']} ISRC misses), {stats['text_searches']} by title search")
+
+    def check_video_limits(self, youtube_video_link, duration, views, max_length, min_view_count):
+        if duration >= max_length:
+            raise ConfigVideoMaxLength(f'Length {duration}s exceeds MAX_LENGTH value of {max_length}s [{youtube_video_link}]')
+
+        if views <= min_view_count:
+            raise ConfigVideoLowViewCount(f'View count {views} does not meet MIN_VIEW_COUNT value of {min_view_count} [{youtube_video_link}]')
+
+    def get_match_keys(self, search_query, track=None):
+        """Keys a resolved match is stored under: the Spotify track id and ISRC (when known) and the normalised search query."""
+        match_keys = []
+
+        if track is not None:
+            match_keys.append("track:" + track.resource_id)
+
+            # the same recording is often on several releases with different track ids
+            isrc = get_track_isrc(track)
+            if isrc:
+                match_keys.append("isrc:" + isrc)
+
+        match_keys.append("query:" + " ".join(search_query.lower().split()))
+
+        return match_keys
+
+    def forget_match(self, search_query, track=None):
+        """Drop a cached match, e.g. because its video could not be downloaded."""
+        if self.match_cache:
+            self.match_cache.forget(self.get_match_keys(search_query, track))
+
+    def download(self, url, audio_bitrate, preferred_subtype=None):
         try:
             youtube_video = pytubeYouTube(
                 url,
@@ -69,6 +177,9 @@ class YouTube:
 
             while retry_count < max_retries:
                 try:
+                    # pytubefix loads the watch page through urllib, so it can't go through the shared session
+                    rate_limiter.acquire(url)
+
                     if youtube_video.age_restricted:
                         print(f"{colours.WARNING}[!] Age restricted video detected. Using innate bypass...{colours.ENDC}")
 
@@ -81,23 +192,13 @@ class YouTube:
                     if not audio_streams:
                         raise Exception("No audio streams available for this video")
 
-                    selected_stream = None
-
-                    for stream in audio_streams:
-                        if not stream.abr:
-                            continue
-
-                        abr_kbps = int(re.sub(r'\D', '', stream.abr))
-                        if abr_kbps <= audio_bitrate / 1000:
-                            selected_stream = stream
-                            break
-
-                    if not selected_stream:
-                        selected_stream = audio_streams.first()  # fallback to highest quality if none match
+                    # prefer streams whose codec the requested output format can take without re-encoding
+                    preferred_streams = [stream for stream in audio_streams if stream.subtype == preferred_subtype] if preferred_subtype else []
+                    selected_stream = self.select_stream(preferred_streams or list(audio_streams), audio_bitrate)
 
                     # Download selected stream
                     print(f"{colours.OKBLUE}[!] Downloading audio stream: {selected_stream.abr}{colours.ENDC}")
-                    yt_tmp_out = selected_stream.download(output_path="./temp/")
+                    yt_tmp_out = self.download_stream(selected_stream, get_video_id(url), "./temp/")
 
                     return yt_tmp_out, int(selected_stream.abr.rstrip('kbps')) * 1000
 
@@ -106,8 +207,14 @@ class YouTube:
                     if retry_count >= max_retries:
                         print(f"{colours.FAIL}[!] Failed after {max_retries} attempts: {str(e)}{colours.ENDC}")
                         raise
+                    run_metrics.add_retry()
                     print(f"{colours.WARNING}[!] Retry {retry_count}/{max_retries}: {str(e)}{colours.ENDC}")
-                    time.sleep(2)  # Wait before retry
+
+                    if isinstance(e, urllib.error.HTTPError) and is_throttled(e.code):
+                        # every worker waits for YouTube's pause, not just this one
+                        rate_limiter.throttled(url, retry_count - 1, e.headers.get("Retry-After"))
+                    else:
+                        time.sleep(backoff_delay(retry_count - 1))
 
                     # Re-initialize YouTube object for retry with different parameters each time
                     if retry_count == 1:
@@ -120,163 +227,72 @@ class YouTube:
             raise
 
 
-class SpotifyDownloader:
-    def __init__(self, spotify: Spotify, youtube: YouTube, audio_quality=1000000, max_length=60*30, min_view_count=10000):
-        self.spotify_client = spotify
-        self.youtube_client = youtube
-        self.audio_quality = audio_quality
-        self.max_length = max_length
-        self.min_view_count = min_view_count
-
-    def download_album(self, playlist_url):
-        skipped_songs = 0
+    def select_stream(self, audio_streams, audio_bitrate):
+        """Pick the best stream at or below the requested bitrate from streams sorted best first."""
+        for stream in audio_streams:
+            if not stream.abr:
+                continue
 
-        print(f"\n{colours.OKBLUE}[!] Retrieving Spotify album")
+            abr_kbps = int(re.sub(r'\D', '', stream.abr))
+            if abr_kbps <= audio_bitrate / 1000:
+                return stream
 
-        try:
-            album = self.spotify_client.album(playlist_url)
-
-            self.prep_folder("downloads/albums/" + album.get_title(True))
-
-            tracks = album.get_tracks()
-
-            print(f"\n{colours.OKBLUE}[!] Found {len(tracks)} tracks in album.")
-
-            time.sleep(3)
-
-            output_path = "downloads/albums/" + album.get_title(True) + "/"
-            self.download_tracks(output_path, tracks)
-
-            return True
-
-        except SpotifyAlbumNotFound as e:
-            print(f"\n{colours.FAIL}Error: {colours.ENDC}{colours.WARNING}Album does not exist (e: {e}).{colours.ENDC}\n")
-            sys.exit(1)
-
-    def download_playlist(self, playlist_url):
-        print(f"\n{colours.OKBLUE}[!] Retrieving Spotify playlist")
+        return audio_streams[0]  # fallback to highest quality if none match
 
-        try:
-            playlist = self.spotify_client.playlist(playlist_url)
-
-            self.prep_folder("downloads/playlists/" + playlist.get_title(True))
-
-            tracks = playlist.get_tracks()
+    def download_stream(self, stream, video_id, output_folder):
+        """
+        Download a stream in chunked range requests to <video id>-<itag>.<ext>.part, renaming it once complete.
+        A .part file left behind by an interrupted download is resumed from where it stopped.
+        """
+        output_path = os.path.join(output_folder, f"{video_id}-{stream.itag}.{stream.subtype}")
+        partial_path = output_path + ".part"
 
-            print(f"\n{colours.OKBLUE}[!] Found {len(tracks)} tracks in playlist.")
+        # two tracks can resolve to the same video, only one of them should write its file
+        with self.download_lock(output_path):
+            if os.path.exists(output_path):
+                return output_path
 
-            time.sleep(3)
+            filesize = stream.filesize
+            downloaded = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
 
-            output_path = "downloads/playlists/" + playlist.get_title(True) + "/"
-            self.download_tracks(output_path, tracks)
+            if downloaded > filesize:
+                downloaded = 0
 
-            return True
+            if downloaded > 0:
+                print(f"{colours.OKBLUE}[!] Resuming download at {downloaded // 1024}/{filesize // 1024} KiB{colours.ENDC}")
 
-        except SpotifyPlaylistNotFound as e:
-            print(f"\n{colours.FAIL}Error: {colours.ENDC}{colours.WARNING}Playlist does not exist (e: {e}).{colours.ENDC}\n")
-            sys.exit(1)
+            with open(partial_path, "ab" if downloaded > 0 else "wb") as partial_file:
+                while downloaded < filesize:
+                    chunk_end = min(downloaded + STREAM_CHUNK_SIZE, filesize) - 1
 
-    def download_tracks(self, output_path, tracks):
-        skipped_tracks = []
-
-        idx_max = len(tracks)
-        for i in range(idx_max):
-            try:
-                track = tracks[i]
-                self.download_track(None, track, i, idx_max, output_path, True)
+                    with transport.session().get(stream.url, headers={"Range": f"bytes={downloaded}-{chunk_end}"}, stream=True) as response:
+                        response.raise_for_status()
 
-            except SpotifyTrackNotFound as e:
-                print(f"   - {colours.WARNING}[!] Skipped a song we could not find.{colours.ENDC} {e}")
-                skipped_tracks.append((track, e))
+                        # the server ignored the range and is sending the whole file
+                        if response.status_code != 206:
+                            partial_file.seek(0)
+                            partial_file.truncate()
+                            downloaded = 0
 
-            except YoutubeItemNotFound as e:
-                print(f"   - {colours.WARNING}[!] Skipped a song found on Spotify but not on YouTube.{colours.ENDC}\n")
-                skipped_tracks.append((track, e))
+                        chunk_start = downloaded
 
-            except ConfigVideoMaxLength as e:
-                print(f"\n{colours.WARNING}[!] Skipped a song - Song length exceeds max length.{colours.ENDC}\n")
-                skipped_tracks.append((track, e))
+                        for data in response.iter_content(chunk_size=64 * 1024):
+                            partial_file.write(data)
+                            downloaded += len(data)
+                            run_metrics.add_bytes(len(data))
 
-            except ConfigVideoLowViewCount as e:
-                print(f"\n{colours.WARNING}[!] Skipped a song - View count below minimum threshold.\n")
-                skipped_tracks.append((track, e))
+                    # an expired or throttled stream URL can answer with an empty body, asking again would never end;
+                    # the retry in download() gets a fresh URL and resumes from the .part file
+                    if downloaded == chunk_start:
+                        raise Exception(f"The stream sent no data at {downloaded // 1024}/{filesize // 1024} KiB")
 
-            except Exception as e:
-                print(f"\n{colours.WARNING}[!] Skipped a song - Something went wrong. {str(e)}{colours.ENDC}\n")
-                skipped_tracks.append((track, e))
-
-        if len(skipped_tracks) > 0:
-            print(f"\n{colours.WARNING}[!] Skipped {len(skipped_tracks)} songs.{colours.ENDC}\n")
-            for (track, reason) in skipped_tracks:
-                print(f"    {track.get_title(True)} {colours.WARNING}[{reason}]{colours.ENDC}")
-
-        return skipped_tracks
-
-    def download_track(self, track_url=None, track=None, idx=0, idx_max=0, output_path=None, as_sub_function=False):
-        try:
-            output_path = output_path if output_path else "downloads/tracks/"
+            os.replace(partial_path, output_path)
 
-            if track_url:
-                track = self.spotify_client.track(track_url)
-            else:
-                if not track:
-                    raise Exception("No Track was supplied to download track!")
+        return output_path
 
-            if track:
-                print(f"\n{colours.OKGREEN}Searching for song [{idx+1}/{idx_max}]: {track.get_title(True)} by {track.get_artist()}")
+    def download_lock(self, output_path):
+        with self.download_locks_lock:
+            if output_path not in self.download_locks:
+                self.download_locks[output_path] = threading.Lock()
 
-            track_title = re.sub(r'[\\/:*?"<>|]', '_', track.get_title(True))
-            track_path = os.path.join(output_path, f"{track_title}.mp3")
-
-            self.prep_folder(output_path)
-            if self.file_exists(track_path):
-                print(f"{colours.OKCYAN}   - File exists, skipping.")
-                return True
-
-            searchable_name = track.get_searchable_title()
-
-            youtube_link = self.youtube_client.search(searchable_name, self.max_length, self.min_view_count)
-
-            print(f"{colours.ENDC}   - Downloading, please wait{colours.ENDC}")
-
-            video_downloaded_path, self.audio_quality = self.youtube_client.download(youtube_link, self.audio_quality)
-
-            print(f"{colours.ENDC}   - Converting and adding metadata{colours.ENDC}")
-
-            resave_audio_clip_with_metadata(video_downloaded_path, track.get_metadata(), track_path, self.audio_quality)
-
-            if os.path.exists(video_downloaded_path):
-                os.remove(video_downloaded_path)
-
-            print(f"{colours.OKGREEN}   - Done!{colours.ENDC}")
-
-            return True
-
-        except SpotifyTrackNotFound as e:
-            if not as_sub_function:
-                print(f"\n{colours.FAIL}Error: {colours.ENDC}Could not find song online (e: {e}).{colours.ENDC}\n")
-                return False
-            else:
-                raise e
-        except Exception as e:
-            if not as_sub_function:
-                print(f"\n{colours.FAIL}Error: {colours.ENDC}{str(e)}{colours.ENDC}\n")
-                return False
-            else:
-                raise e
-
-    def prep_folder(self, folder_name):
-        Path(folder_name).mkdir(parents=True, exist_ok=True)
-        Path('temp/').mkdir(parents=True, exist_ok=True)
-
-    def file_exists(self, file_path):
-        return Path.exists(Path(file_path))
-
-    def rm_tmp_folder(self):
-        try:
-            if os.path.exists('./temp'):
-                shutil.rmtree('./temp')
-                print(f"{colours.OKBLUE}[!] Temporary files cleaned up.{colours.ENDC}")
-        except Exception as e:
-            print(f"{colours.WARNING}[!] Failed to clean up temporary files: {str(e)}{colours.ENDC}")
-            
+            return self.download_locks[output_path]
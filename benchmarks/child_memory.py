@@ -0,0 +1,71 @@
+"""
+Peak memory of the ffmpeg processes a benchmark starts, sampled from /proc while they run.
+
+resource.getrusage(RUSAGE_CHILDREN) and os.wait4() can't be used for this on Linux: a forked child starts out
+with its parent's resident set and exec keeps that peak, so every child reports at least the parent's peak RSS.
+VmHWM in /proc/<pid>/status only covers the program the child executed. Linux only, elsewhere nothing is sampled.
+"""
+import glob
+import os
+import threading
+
+
+class ChildMemorySampler():
+    """
+    Polls the peak RSS of this process's children whose name starts with name_prefix, for as long as it's used as
+    a context manager. A child is only seen once it has executed the program, before that it still is a copy of
+    this process. A child that exits between two polls is missed, so keep the interval well under its run time.
+    """
+    def __init__(self, name_prefix="ffmpeg", interval=0.002):
+        self.name_prefix = name_prefix
+        self.interval = interval
+        self.peaks = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        # children started by any thread, each thread lists its own
+        for children_path in glob.glob(f"/proc/{os.getpid()}/task/*/children"):
+            try:
+                with open(children_path) as children_file:
+                    pids = children_file.read().split()
+            except OSError:
+                continue
+
+            for pid in pids:
+                peak = self.read_peak(pid)
+                if peak is not None:
+                    self.peaks[pid] = max(peak, self.peaks.get(pid, 0))
+
+    def read_peak(self, pid):
+        """VmHWM of a child in KiB, or None if it's gone or isn't running the program yet."""
+        try:
+            with open(f"/proc/{pid}/status") as status_file:
+                status = dict(line.split(":", 1) for line in status_file if ":" in line)
+        except OSError:
+            return None
+
+        if not status.get("Name", "").strip().startswith(self.name_prefix) or "VmHWM" not in status:
+            return None
+
+        return int(status["VmHWM"].split()[0])
+
+    def peak_kib(self):
+        """The largest peak of any sampled child, or None if no child was seen."""
+        return max(self.peaks.values(), default=None)
+
+    def process_count(self):
+        return len(self.peaks)
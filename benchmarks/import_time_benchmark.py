@@ -0,0 +1,96 @@
+"""
+Regression check for how long spotify2mp3.py takes to start. Runs the given command line under
+python -X importtime, reports the slowest imports, and exits with an error when a heavy dependency is
+imported before it's needed or when the project's imports take longer than the budget.
+
+    python benchmarks/import_time_benchmark.py [--runs 5] [--budget-ms 150] [-- --help]
+
+The arguments after -- are passed to spotify2mp3.py and default to --help. Startup modules such as site and
+encodings are left out of the total, since they're the interpreter's own cost.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# none of these are needed to print the help, report the match cache or reject a bad argument
+HEAVY_MODULES = ["tekore", "pytubefix", "youtube_search", "flask", "bs4", "eyed3", "mutagen", "imageio_ffmpeg", "httpx", "requests", "aiohttp", "moviepy", "numpy"]
+
+INTERPRETER_MODULES = {"site", "encodings", "_frozen_importlib_external", "zipimport", "codecs", "io", "abc", "time"}
+
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_import_time(arguments):
+    """Return (module, cumulative microseconds) for every top level import of one run."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "spotify2mp3.py", *arguments],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    imports = []
+
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+
+        # one space of indentation marks an import made directly by the script (or by the interpreter)
+        if match and len(match.group(3)) == 1:
+            imports.append((match.group(4), int(match.group(2))))
+
+    return imports, result.stderr
+
+def imported_modules(stderr):
+    return {match.group(4) for match in IMPORT_TIME_PATTERN.finditer(stderr)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how long spotify2mp3.py spends importing modules.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=150, help="Fail when the project's imports take longer than this")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("arguments", nargs="*", default=["--help"], help="Arguments for spotify2mp3.py")
+    args = parser.parse_args()
+
+    totals = []
+    module_times = {}
+    loaded_modules = set()
+
+    for _ in range(args.runs):
+        (imports, stderr) = run_import_time(args.arguments)
+        project_imports = [(module, microseconds) for (module, microseconds) in imports if module.split(".")[0] not in INTERPRETER_MODULES]
+
+        totals.append(sum(microseconds for (_, microseconds) in project_imports))
+        for (module, microseconds) in project_imports:
+            module_times.setdefault(module, []).append(microseconds)
+
+        loaded_modules |= imported_modules(stderr)
+
+    total_ms = statistics.median(totals) / 1000
+
+    print(f"spotify2mp3.py {' '.join(args.arguments)}: {total_ms:.1f} ms of imports (median of {args.runs} runs)\n")
+
+    slowest = sorted(module_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)[:args.top]
+    for (module, microseconds) in slowest:
+        print(f"{statistics.median(microseconds) / 1000:>10.1f} ms  {module}")
+
+    heavy_loaded = [module for module in HEAVY_MODULES if module in loaded_modules]
+    failed = False
+
+    if heavy_loaded:
+        print(f"\nFAIL: imported before they're needed: {', '.join(heavy_loaded)}")
+        failed = True
+
+    if total_ms > args.budget_ms:
+        print(f"\nFAIL: imports took {total_ms:.1f} ms, the budget is {args.budget_ms:.0f} ms")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
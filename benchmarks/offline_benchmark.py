@@ -0,0 +1,555 @@
+"""
+Runs the whole download flow (SpotifyDownloader.download_playlist, download_album or download_liked_songs)
+against local stand-ins for every service it talks to, and reports throughput, the time each track spent in
+each stage and peak memory for collections of 10, 1,000 and 10,000 tracks.
+
+Nothing leaves the machine. The stand-ins sit at the edge of the project's own HTTP clients, so the rate
+limiter, retries, paging, caches, pipeline, ffmpeg and the tag writers all run for real:
+
+- the Spotify Web API is an httpx.MockTransport behind tekore's sync and async clients. It pages
+  playlists, albums and saved tracks and answers every --throttle-every'th request with a 429.
+- YouTube search, the audio stream hosts and the cover art host are a requests adapter mounted on the
+  shared session. Search pages embed ytInitialData like the real ones, streams honour Range requests and
+  serve a generated AAC tone.
+- pytubefix is replaced by a video object that lists that one stream, as it can't be pointed at another host.
+- login is skipped with a dummy access token.
+
+Every collection size runs in a fresh child process inside its own temporary folder, so caches, the manifest
+and peak RSS start from nothing each time. The peak RSS of ffmpeg is sampled from /proc while the conversions
+run, so it's only reported on Linux, and a conversion that finishes between two samples isn't counted.
+
+    python benchmarks/offline_benchmark.py [--sizes 10,1000,10000] [--collection playlist] [--workers 4]
+                                           [--latency-ms 20] [--throttle-every 10] [--clip-seconds 10]
+
+Use --json FILE to keep the results for comparing two revisions. Needs a Unix-like OS (for the resource
+module) and the packages in requirements.txt. 10,000 tracks means 10,000 ffmpeg runs, expect it to take a while.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import const
+from child_memory import ChildMemorySampler
+
+COLLECTIONS = ("playlist", "album", "liked")
+
+OFFLINE_TOKEN = "offline-benchmark-token"
+PLAYLIST_ID = "0ff1ine0benchmark0list0"
+ALBUM_ID = "0ff1ine0benchmark0a1bm"
+USER_ID = "offline-user"
+
+TRACKS_PER_ALBUM = 12
+ARTIST_COUNT = 97
+TRACK_DURATION_MS = 200000
+# every n'th ISRC search finds nothing, so the title search and ranking run for some tracks too
+ISRC_MISS_EVERY = 10
+# a rate and burst no run can use up, for when the real per host limits are lifted
+UNLIMITED_RATE = 10 ** 9
+
+SEARCH_HOST = "www.youtube.com"
+STREAM_HOST = "rr1---sn-offline.googlevideo.com"
+COVER_HOST = "i.scdn.co"
+
+
+def track_id(index):
+    return f"{index:022d}"
+
+def album_id(album_index):
+    return f"a{album_index:021d}"
+
+def video_id(index):
+    return f"v{index:010d}"
+
+def track_isrc(index):
+    return f"QZOFF{index:07d}"
+
+def track_title(index):
+    return f"Song {index}"
+
+def artist_name(index):
+    return f"Artist {index % ARTIST_COUNT}"
+
+
+class FakeSpotifyAPI():
+    """
+    The Web API endpoints the downloader uses, answering from a generated catalogue of total tracks, TRACKS_PER_ALBUM to
+    an album. One playlist (PLAYLIST_ID), one album (ALBUM_ID) and the user's saved tracks all hold the whole catalogue.
+    """
+    def __init__(self, total, latency, throttle_every):
+        self.total = total
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def handle(self, request):
+        import httpx
+
+        if self.count_request():
+            return httpx.Response(429, headers={"Retry-After": "0"})
+
+        time.sleep(self.latency)
+        return self.respond(request)
+
+    async def async_handle(self, request):
+        import httpx
+
+        if self.count_request():
+            return httpx.Response(429, headers={"Retry-After": "0"})
+
+        await asyncio.sleep(self.latency)
+        return self.respond(request)
+
+    def count_request(self):
+        """Count a request, returning whether it should be throttled."""
+        with self.lock:
+            self.requests += 1
+            throttle = self.throttle_every > 0 and self.requests % self.throttle_every == 0
+
+            if throttle:
+                self.throttled += 1
+
+            return throttle
+
+    def respond(self, request):
+        import httpx
+
+        path = request.url.path.rstrip("/")
+        params = request.url.params
+        offset = int(params.get("offset", 0))
+
+        if path == f"/v1/playlists/{PLAYLIST_ID}":
+            return httpx.Response(200, json=self.playlist())
+        if path in (f"/v1/playlists/{PLAYLIST_ID}/tracks", f"/v1/playlists/{PLAYLIST_ID}/items"):
+            return httpx.Response(200, json=self.playlist_items(offset, int(params.get("limit", 100))))
+        if path == f"/v1/albums/{ALBUM_ID}":
+            return httpx.Response(200, json=self.album())
+        if path == f"/v1/albums/{ALBUM_ID}/tracks":
+            return httpx.Response(200, json=self.album_tracks(offset, int(params.get("limit", 50))))
+        if path == "/v1/tracks":
+            return httpx.Response(200, json={"tracks": [self.track(int(resource_id)) for resource_id in params["ids"].split(",")]})
+        if path == "/v1/me/tracks":
+            return httpx.Response(200, json=self.saved_tracks(offset, int(params.get("limit", 20))))
+        if path == "/v1/me":
+            return httpx.Response(200, json={**self.user(), "account_id": USER_ID})
+
+        return httpx.Response(404, json={"error": {"status": 404, "message": "Not found."}})
+
+    def paging(self, path, items, offset, limit):
+        url = "https://api.spotify.com/v1" + path
+        next_url = f"{url}?offset={offset + limit}&limit={limit}" if offset + limit < self.total else None
+        previous_url = f"{url}?offset={max(0, offset - limit)}&limit={limit}" if offset > 0 else None
+
+        return {"href": url, "items": items, "limit": limit, "next": next_url, "offset": offset, "previous": previous_url, "total": self.total}
+
+    def playlist(self):
+        first_page = self.playlist_items(0, 100)
+
+        return {
+            "id": PLAYLIST_ID, "name": "Offline Benchmark", "type": "playlist", "uri": f"spotify:playlist:{PLAYLIST_ID}",
+            "href": f"https://api.spotify.com/v1/playlists/{PLAYLIST_ID}", "external_urls": {"spotify": f"https://open.spotify.com/playlist/{PLAYLIST_ID}"},
+            "collaborative": False, "description": "", "followers": {"href": None, "total": 0}, "images": [],
+            "owner": self.user(), "public": True, "snapshot_id": f"snapshot-{self.total}", "primary_color": None,
+            "tracks": first_page, "items": first_page,
+        }
+
+    def playlist_items(self, offset, limit):
+        items = [
+            {"added_at": "2020-01-01T00:00:00Z", "added_by": self.user(), "is_local": False, "primary_color": None,
+             "video_thumbnail": {"url": None}, "track": self.track(index), "item": self.track(index)}
+            for index in range(offset, min(offset + limit, self.total))
+        ]
+
+        return self.paging(f"/playlists/{PLAYLIST_ID}/tracks", items, offset, limit)
+
+    def album(self):
+        return {**self.simple_album(0), "id": ALBUM_ID, "name": "Offline Benchmark Album", "total_tracks": self.total,
+                "copyrights": [], "external_ids": {}, "genres": [], "label": "", "popularity": 0,
+                "tracks": self.album_tracks(0, 50)}
+
+    def album_tracks(self, offset, limit):
+        items = [self.simple_track(index) for index in range(offset, min(offset + limit, self.total))]
+
+        return self.paging(f"/albums/{ALBUM_ID}/tracks", items, offset, limit)
+
+    def saved_tracks(self, offset, limit):
+        # newest first, one save a minute
+        items = [
+            {"added_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1600000000 + (self.total - index) * 60)), "track": self.track(index)}
+            for index in range(offset, min(offset + limit, self.total))
+        ]
+
+        return self.paging("/me/tracks", items, offset, limit)
+
+    def user(self):
+        return {"id": USER_ID, "type": "user", "uri": f"spotify:user:{USER_ID}", "href": f"https://api.spotify.com/v1/users/{USER_ID}",
+                "external_urls": {}, "display_name": "Offline", "followers": {"href": None, "total": 0}, "images": []}
+
+    def artist(self, index):
+        resource_id = f"r{index % ARTIST_COUNT:021d}"
+
+        return {"id": resource_id, "name": artist_name(index), "type": "artist", "uri": f"spotify:artist:{resource_id}",
+                "href": f"https://api.spotify.com/v1/artists/{resource_id}", "external_urls": {"spotify": f"https://open.spotify.com/artist/{resource_id}"}}
+
+    def simple_album(self, album_index):
+        resource_id = album_id(album_index)
+
+        return {"id": resource_id, "name": f"Album {album_index}", "type": "album", "uri": f"spotify:album:{resource_id}",
+                "href": f"https://api.spotify.com/v1/albums/{resource_id}", "external_urls": {"spotify": f"https://open.spotify.com/album/{resource_id}"},
+                "album_type": "album", "artists": [self.artist(album_index)], "available_markets": [],
+                "images": [{"url": f"https://{COVER_HOST}/image/{resource_id}", "height": 640, "width": 640}],
+                "release_date": "2011-05-23", "release_date_precision": "day", "total_tracks": TRACKS_PER_ALBUM}
+
+    def simple_track(self, index):
+        resource_id = track_id(index)
+
+        return {"id": resource_id, "name": track_title(index), "type": "track", "uri": f"spotify:track:{resource_id}",
+                "href": f"https://api.spotify.com/v1/tracks/{resource_id}", "external_urls": {"spotify": f"https://open.spotify.com/track/{resource_id}"},
+                "artists": [self.artist(index)], "available_markets": [], "disc_number": 1, "duration_ms": TRACK_DURATION_MS,
+                "explicit": False, "is_local": False, "preview_url": None, "track_number": index % TRACKS_PER_ALBUM + 1}
+
+    def track(self, index):
+        return {**self.simple_track(index), "album": self.simple_album(index // TRACKS_PER_ALBUM),
+                "external_ids": {"isrc": track_isrc(index)}, "popularity": 0, "episode": False, "track": True}
+
+
+class FakeHostsAdapter():
+    """
+    requests transport adapter answering for YouTube search, the stream host and the cover art host. Any other
+    host gets a connection error, so a request the benchmark doesn't know about can't reach the network.
+    """
+    def __init__(self, audio_data, cover_data, latency, throttle_every):
+        self.audio_data = audio_data
+        self.cover_data = cover_data
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.searches = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        import requests
+
+        url = urllib.parse.urlparse(request.url)
+        time.sleep(self.latency)
+
+        if url.hostname == SEARCH_HOST and url.path == "/results":
+            if self.count_search():
+                return self.build_response(request, 429, b"", {"Retry-After": "0"})
+
+            query = urllib.parse.parse_qs(url.query)["search_query"][0]
+            return self.build_response(request, 200, self.search_page(query).encode("utf-8"), {"Content-Type": "text/html; charset=utf-8"})
+
+        if url.hostname == STREAM_HOST and url.path == "/videoplayback":
+            return self.stream_response(request)
+
+        if url.hostname == COVER_HOST:
+            return self.build_response(request, 200, self.cover_data, {"Content-Type": "image/png"})
+
+        raise requests.ConnectionError(f"The offline benchmark has no stand-in for {request.url}", request=request)
+
+    def close(self):
+        pass
+
+    def count_search(self):
+        with self.lock:
+            self.searches += 1
+            throttle = self.throttle_every > 0 and self.searches % self.throttle_every == 0
+
+            if throttle:
+                self.throttled += 1
+
+            return throttle
+
+    def stream_response(self, request):
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+
+        if not match:
+            return self.build_response(request, 200, self.audio_data, {"Content-Type": "audio/mp4"})
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(self.audio_data) - 1
+        body = self.audio_data[start:end + 1]
+
+        return self.build_response(request, 206, body, {"Content-Type": "audio/mp4", "Content-Range": f"bytes {start}-{start + len(body) - 1}/{len(self.audio_data)}"})
+
+    def build_response(self, request, status_code, body, headers):
+        import io
+
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict({**headers, "Content-Length": str(len(body))})
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+
+        return response
+
+    def search_page(self, query):
+        """A results page with the track's official upload first, then a live version and a cover to rank against."""
+        isrc_match = re.fullmatch(r'"QZOFF(\d{7})"', query.strip())
+        title_match = re.search(r"Song (\d+)", query)
+
+        if isrc_match:
+            index = int(isrc_match.group(1))
+            videos = [] if index % ISRC_MISS_EVERY == 0 else self.search_results(index)
+        elif title_match:
+            videos = self.search_results(int(title_match.group(1)))
+        else:
+            videos = []
+
+        data = {"contents": {"twoColumnSearchResultsRenderer": {"primaryContents": {"sectionListRenderer": {"contents": [
+            {"itemSectionRenderer": {"contents": [{"videoRenderer": video} for video in videos]}},
+        ]}}}}}
+
+        return f"<html><body><script>var ytInitialData = {json.dumps(data)};</script></body></html>"
+
+    def search_results(self, index):
+        duration_seconds = TRACK_DURATION_MS // 1000
+        results = [
+            (video_id(index), f"{artist_name(index)} - {track_title(index)} (Official Audio)", f"{artist_name(index)} - Topic", duration_seconds, 2500000),
+            (f"l{index:010d}", f"{artist_name(index)} - {track_title(index)} (Live)", "Concert Uploads", duration_seconds + 45, 80000),
+            (f"c{index:010d}", f"{track_title(index)} cover", "Covers Daily", duration_seconds + 5, 12000),
+        ]
+
+        return [
+            {"videoId": result_id, "title": {"runs": [{"text": title}]}, "longBylineText": {"runs": [{"text": channel}]},
+             "lengthText": {"simpleText": f"{duration // 60}:{duration % 60:02d}"}, "viewCountText": {"simpleText": f"{views:,} views"},
+             "publishedTimeText": {"simpleText": "1 year ago"}, "thumbnail": {"thumbnails": [{"url": ""}]},
+             "navigationEndpoint": {"commandMetadata": {"webCommandMetadata": {"url": f"/watch?v={result_id}"}}}}
+            for (result_id, title, channel, duration, views) in results
+        ]
+
+
+class FakeStream():
+    def __init__(self, resource_id, filesize):
+        self.itag = 140
+        self.subtype = "mp4"
+        self.abr = "128kbps"
+        self.filesize = filesize
+        self.url = f"https://{STREAM_HOST}/videoplayback?id={resource_id}&itag={self.itag}"
+
+
+class FakeStreamQuery(list):
+    """The part of pytubefix's StreamQuery that YouTube.download() uses."""
+    def filter(self, **kwargs):
+        return self
+
+    def order_by(self, attribute):
+        return self
+
+    def desc(self):
+        return self
+
+
+class FakeVideo():
+    """Stands in for pytubefix.YouTube: one AAC stream served by FakeHostsAdapter, no watch page or deciphering."""
+    audio_size = 0
+
+    def __init__(self, url, **kwargs):
+        resource_id = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)["v"][0]
+
+        self.age_restricted = False
+        self.streams = FakeStreamQuery([FakeStream(resource_id, FakeVideo.audio_size)])
+
+
+def generate_audio(output_folder, seconds):
+    import imageio_ffmpeg
+
+    audio_path = os.path.join(output_folder, "stream.m4a")
+    subprocess.run([
+        imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-codec:a", "aac", "-b:a", "128k", audio_path,
+    ], check=True)
+
+    with open(audio_path, "rb") as audio_file:
+        return audio_file.read()
+
+def peak_rss_kib(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def install_fakes(spotify_api, hosts_adapter, keep_rate_limits):
+    import httpx
+
+    import apis.youtube
+    import login
+    from ratelimit import rate_limiter
+    from transport import transport
+
+    login.get_user_token = lambda: OFFLINE_TOKEN
+    apis.youtube.pytubeYouTube = FakeVideo
+
+    transport.httpx_client = httpx.Client(transport=httpx.MockTransport(spotify_api.handle))
+    transport.async_spotify_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(spotify_api.async_handle))
+    transport.session().mount("https://", hosts_adapter)
+
+    # the stand-ins answer straight away, with the real limits the limiter would be all that's measured
+    if not keep_rate_limits:
+        rate_limiter.limits = {}
+        rate_limiter.default_limit = (UNLIMITED_RATE, UNLIMITED_RATE)
+
+def run_size(args):
+    """Runs inside the child process, in an empty working folder, and prints its measurements as JSON."""
+    from apis.spotify import Spotify
+    from apis.youtube import YouTube
+    from cache import MetadataCache, MatchCache
+    from content_store import ContentStore
+    from downloader import SpotifyDownloader
+    from manifest import DownloadManifest
+    from metrics import run_metrics
+    from transport import transport
+
+    FakeVideo.audio_size = len(args.audio_data)
+    # the stage percentiles are part of the results
+    run_metrics.keep_tracks = True
+
+    with open(const.UNKNOWN_ALBUM_COVER_PATH, "rb") as cover_file:
+        cover_data = cover_file.read()
+
+    spotify_api = FakeSpotifyAPI(args.run_size, args.latency_ms / 1000, args.throttle_every)
+    hosts_adapter = FakeHostsAdapter(args.audio_data, cover_data, args.latency_ms / 1000, args.throttle_every)
+    install_fakes(spotify_api, hosts_adapter, args.rate_limits)
+
+    metadata_cache = MetadataCache()
+    match_cache = MatchCache()
+    manifest = DownloadManifest()
+
+    spotify = Spotify(const.SpotifyAuthType.USER, metadata_cache, args.async_loading)
+    youtube = YouTube(match_cache)
+    downloader = SpotifyDownloader(spotify, youtube, 160000, const.DEFAULT_MAX_LENGTH_FOR_DOWNLOAD, const.DEFAULT_MIN_VIEWS_FOR_DOWNLOAD,
+                                   args.workers, None, const.DEFAULT_QUEUE_SIZE, False, manifest, args.output_format, ContentStore(manifest))
+
+    # the per-track progress lines would be most of the output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), ChildMemorySampler() as ffmpeg_memory:
+        start = time.perf_counter()
+
+        if args.collection == "playlist":
+            downloader.download_playlist(f"https://open.spotify.com/playlist/{PLAYLIST_ID}")
+        elif args.collection == "album":
+            downloader.download_album(f"https://open.spotify.com/album/{ALBUM_ID}")
+        else:
+            downloader.download_liked_songs()
+
+        wall_seconds = time.perf_counter() - start
+
+        downloader.rm_tmp_folder()
+
+    manifest.close()
+    metadata_cache.close()
+    match_cache.close()
+    transport.close()
+
+    outcomes = run_metrics.outcomes()
+
+    print(json.dumps({
+        "tracks": args.run_size,
+        "wall_seconds": wall_seconds,
+        "tracks_per_minute": outcomes.get("downloaded", 0) / wall_seconds * 60,
+        "outcomes": outcomes,
+        "stages": run_metrics.summary(),
+        "stage_table": run_metrics.format_summary(),
+        "spotify_requests": spotify_api.requests,
+        "searches": hosts_adapter.searches,
+        "throttled": spotify_api.throttled + hosts_adapter.throttled,
+        "python_peak_rss_kib": peak_rss_kib(resource.RUSAGE_SELF),
+        "ffmpeg_peak_rss_kib": ffmpeg_memory.peak_kib(),
+        "ffmpeg_processes_sampled": ffmpeg_memory.process_count(),
+    }))
+
+def child_arguments(args, size, audio_path):
+    arguments = [
+        sys.executable, os.path.abspath(__file__),
+        "--run-size", str(size), "--audio", audio_path,
+        "--collection", args.collection, "--workers", str(args.workers), "--latency-ms", str(args.latency_ms),
+        "--throttle-every", str(args.throttle_every), "--output-format", args.output_format,
+    ]
+
+    if args.async_loading:
+        arguments.append("--async-loading")
+    if args.rate_limits:
+        arguments.append("--rate-limits")
+
+    return arguments
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a full download run against local stand-ins for Spotify and YouTube.")
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma separated numbers of tracks in the collection")
+    parser.add_argument("--collection", choices=COLLECTIONS, default="playlist", help="What to download")
+    parser.add_argument("--workers", type=int, default=const.DEFAULT_WORKER_COUNT, help="Download workers")
+    parser.add_argument("--output-format", choices=const.OUTPUT_FORMATS, default=const.DEFAULT_OUTPUT_FORMAT, help="Format the songs are saved in")
+    parser.add_argument("--async-loading", action="store_true", help="Fetch the collection's pages concurrently")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Time every stand-in takes to answer a request")
+    parser.add_argument("--throttle-every", type=int, default=10, help="Answer every n'th Spotify request and YouTube search with a 429 (0 never does)")
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the per host limits from RATE_LIMITS instead of lifting them")
+    parser.add_argument("--clip-seconds", type=int, default=10, help="Length of the audio every stream serves")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--audio", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        with open(args.audio, "rb") as audio_file:
+            args.audio_data = audio_file.read()
+
+        with tempfile.TemporaryDirectory() as work_folder:
+            os.chdir(work_folder)
+            run_size(args)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+
+    with tempfile.TemporaryDirectory() as audio_folder:
+        generate_audio(audio_folder, args.clip_seconds)
+        audio_path = os.path.join(audio_folder, "stream.m4a")
+
+        print(f"{args.collection}, {args.workers} workers, {args.latency_ms:.0f} ms latency, a 429 every {args.throttle_every} requests, "
+              f"{args.clip_seconds} s streams ({os.path.getsize(audio_path) // 1024} KiB) to {args.output_format}"
+              f"{', async loading' if args.async_loading else ''}{', real rate limits' if args.rate_limits else ''}\n")
+
+        for size in sizes:
+            result = subprocess.run(child_arguments(args, size, audio_path), capture_output=True, text=True)
+
+            if result.returncode != 0:
+                print(f"{size} tracks failed: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode}\n")
+                continue
+
+            measurements = json.loads(result.stdout.strip().splitlines()[-1])
+            results.append(measurements)
+
+            outcomes = ", ".join(f"{count} {outcome}" for (outcome, count) in measurements["outcomes"].items())
+            print(f"{size} tracks: {measurements['tracks_per_minute']:.0f} tracks/min, {measurements['wall_seconds']:.1f} s ({outcomes})")
+            print(f"{measurements['spotify_requests']} Spotify requests, {measurements['searches']} searches, {measurements['throttled']} answered with a 429")
+            ffmpeg_peak = measurements["ffmpeg_peak_rss_kib"]
+            ffmpeg_summary = f"{ffmpeg_peak / 1024:.1f} MiB largest ffmpeg (of {measurements['ffmpeg_processes_sampled']} sampled)" if ffmpeg_peak is not None else "ffmpeg not sampled"
+            print(f"Peak RSS: {measurements['python_peak_rss_kib'] / 1024:.1f} MiB python, {ffmpeg_summary}\n")
+            print(measurements["stage_table"] + "\n")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump({"settings": {key: value for (key, value) in vars(args).items() if key not in ("run_size", "audio", "json")}, "results": results}, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Measures how much memory each loaded track keeps alive, comparing apis.spotify.TrackRecord with the
+SpotifyTrack layout it replaced (a client back-reference, the URL, its regex match and the nested metadata dict).
+
+Tracks are rebuilt from a JSON payload shaped like the metadata cache, so every string starts out as a separate
+object just like after a cache read or an API response. The retained size is what is still allocated once the
+decoded payload has been dropped, measured with tracemalloc. The time to build every sanitised file name is
+reported too, since the old layout rebuilt it character by character on every call.
+
+    python benchmarks/track_memory_benchmark.py [--tracks 50000] [--tracks-per-album 12]
+"""
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import const
+from apis.spotify import TrackRecord
+
+
+class LegacySpotifyTrack():
+    """The per-track layout used before TrackRecord."""
+    def __init__(self, base, resource_url):
+        self.base = base
+        self.resource_url = resource_url
+        self.resource_id_match = re.search(r"/track/([a-zA-Z0-9]+)", self.resource_url)
+        self.resource_id = self.resource_id_match.group(1)
+        self.track_metadata = {}
+
+    def get_title(self, sanitize=False):
+        track_title = self.track_metadata.get("title", "Unknown Title")
+
+        if not sanitize:
+            return track_title
+
+        return "".join([current_character for current_character in track_title if current_character in const.LEGAL_PATH_CHARACTERS])
+
+
+def legacy_track(track_metadata):
+    track = LegacySpotifyTrack(None, track_metadata["comments"]["Spotify Track URL"])
+    track.track_metadata = track_metadata
+    return track
+
+def record_track(track_metadata):
+    return TrackRecord.from_metadata(track_metadata)
+
+def generate_payload(track_count, tracks_per_album):
+    tracks = []
+
+    for index in range(track_count):
+        album_index = index // tracks_per_album
+        tracks.append({
+            "id": f"{index:022d}",
+            "title": f"Song number {index} (feat. Somebody) - 2011 Remaster",
+            "artist": [f"Artist {album_index % 997}", "Somebody"],
+            "album": f"Album number {album_index}",
+            "release_date": "2011-05-23",
+            "track_num": index % tracks_per_album + 1,
+            "disc_num": 1,
+            "isrc": f"GBAYE{index:07d}",
+            "comments": {
+                "Spotify Track URL": f"https://open.spotify.com/track/{index:022d}",
+                "Spotify Album URL": f"https://open.spotify.com/album/{album_index:022d}",
+                "Spotify Artist URL": f"https://open.spotify.com/artist/{album_index % 997:022d}",
+                "Duration (ms)": str(180000 + index % 60000),
+                "Album Type": "album",
+            },
+            "image_url": f"https://i.scdn.co/image/{album_index:040d}",
+        })
+
+    return json.dumps(tracks)
+
+def measure(build_track, payload):
+    gc.collect()
+    tracemalloc.start()
+
+    tracks = [build_track(track_metadata) for track_metadata in json.loads(payload)]
+    gc.collect()
+
+    (retained, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for track in tracks:
+        track.get_title(sanitize=True)
+    sanitize_seconds = time.perf_counter() - start
+
+    return retained, peak, sanitize_seconds, len(tracks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory each loaded track keeps alive.")
+    parser.add_argument("--tracks", type=int, default=50000, help="Number of tracks to load")
+    parser.add_argument("--tracks-per-album", type=int, default=12, help="Tracks sharing one album name, URL and cover")
+    args = parser.parse_args()
+
+    payload = generate_payload(args.tracks, args.tracks_per_album)
+
+    print(f"{args.tracks} tracks, {args.tracks_per_album} per album\n")
+    print(f"{'layout':<14}{'retained MiB':>14}{'bytes/track':>14}{'peak MiB':>12}{'sanitise ms':>14}")
+
+    for (name, build_track) in (("SpotifyTrack", legacy_track), ("TrackRecord", record_track)):
+        (retained, peak, sanitize_seconds, track_count) = measure(build_track, payload)
+
+        print(f"{name:<14}{retained / 1024 / 1024:>14.1f}{retained / track_count:>14.0f}{peak / 1024 / 1024:>12.1f}{sanitize_seconds * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
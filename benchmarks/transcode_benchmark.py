@@ -0,0 +1,118 @@
+"""
+Compares the ffmpeg transcoding path in utils.transcode_audio_clip with the MoviePy path it replaced.
+
+Each backend converts the same input several times in a fresh child process, so the peak RSS of one
+backend can't leak into the other. Peak RSS is reported separately for the Python process and for the
+largest ffmpeg process it started, sampled from /proc (so only on Linux): MoviePy pulls every decoded sample
+through Python, while the direct path leaves all of the audio inside a single ffmpeg process.
+
+    python benchmarks/transcode_benchmark.py [input audio file] [--runs 5] [--bitrate 160000]
+
+Without an input file a 4 minute test tone in an m4a container is generated, roughly the size of a song
+downloaded from YouTube. Needs a Unix-like OS (for the resource module) and the packages in requirements.txt.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from child_memory import ChildMemorySampler
+
+BACKENDS = ("ffmpeg", "moviepy")
+
+
+def moviepy_transcode(audio_input_path, audio_output_path, audio_quality):
+    """The transcoding path used before utils.transcode_audio_clip called ffmpeg directly."""
+    from moviepy.editor import AudioFileClip
+
+    clip = AudioFileClip(audio_input_path)
+    clip.write_audiofile(audio_output_path, logger=None, bitrate=f'{audio_quality // 1000}k')
+    clip.close()
+
+def ffmpeg_transcode(audio_input_path, audio_output_path, audio_quality):
+    from utils import transcode_audio_clip
+
+    transcode_audio_clip(audio_input_path, audio_output_path, audio_quality)
+
+def peak_rss_kib(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def run_backend(backend, audio_input_path, audio_quality, runs):
+    """Runs inside the child process and prints its measurements as JSON."""
+    transcode = ffmpeg_transcode if backend == "ffmpeg" else moviepy_transcode
+    timings = []
+
+    with tempfile.TemporaryDirectory() as output_folder, ChildMemorySampler() as ffmpeg_memory:
+        for run in range(runs):
+            audio_output_path = os.path.join(output_folder, f"{run}.mp3")
+
+            start = time.perf_counter()
+            transcode(audio_input_path, audio_output_path, audio_quality)
+            timings.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        "backend": backend,
+        "timings": timings,
+        "python_peak_rss_kib": peak_rss_kib(resource.RUSAGE_SELF),
+        "ffmpeg_peak_rss_kib": ffmpeg_memory.peak_kib(),
+    }))
+
+def generate_test_input(output_folder, seconds):
+    import imageio_ffmpeg
+
+    audio_input_path = os.path.join(output_folder, "test-tone.m4a")
+    subprocess.run([
+        imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-codec:a", "aac", "-b:a", "128k", audio_input_path,
+    ], check=True)
+
+    return audio_input_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ffmpeg against MoviePy for converting downloaded songs to mp3.")
+    parser.add_argument("input", nargs="?", help="Audio file to convert (a test tone is generated when omitted)")
+    parser.add_argument("--runs", type=int, default=5, help="Conversions per backend")
+    parser.add_argument("--bitrate", type=int, default=160000, help="Output bitrate in bits per second")
+    parser.add_argument("--seconds", type=int, default=240, help="Length of the generated test tone")
+    parser.add_argument("--run-backend", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        run_backend(args.run_backend, args.input, args.bitrate, args.runs)
+        return
+
+    with tempfile.TemporaryDirectory() as work_folder:
+        audio_input_path = args.input or generate_test_input(work_folder, args.seconds)
+
+        print(f"Input: {audio_input_path} ({os.path.getsize(audio_input_path) // 1024} KiB), {args.runs} runs per backend at {args.bitrate} bps\n")
+        print(f"{'backend':<10}{'mean s':>10}{'min s':>10}{'max s':>10}{'python peak MiB':>18}{'ffmpeg peak MiB':>18}")
+
+        for backend in BACKENDS:
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), audio_input_path, "--runs", str(args.runs), "--bitrate", str(args.bitrate), "--run-backend", backend],
+                capture_output=True, text=True)
+
+            if result.returncode != 0:
+                print(f"{backend:<10}failed: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode}")
+                continue
+
+            measurements = json.loads(result.stdout.strip().splitlines()[-1])
+            timings = measurements["timings"]
+
+            ffmpeg_peak = measurements["ffmpeg_peak_rss_kib"]
+
+            print(f"{backend:<10}{sum(timings) / len(timings):>10.2f}{min(timings):>10.2f}{max(timings):>10.2f}"
+                  f"{measurements['python_peak_rss_kib'] / 1024:>18.1f}{f'{ffmpeg_peak / 1024:.1f}' if ffmpeg_peak is not None else 'n/a':>18}")
+
+
+if __name__ == "__main__":
+    main()
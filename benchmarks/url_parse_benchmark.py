@@ -0,0 +1,100 @@
+"""
+Times the URL handling and file name sanitising that every track and collection goes through, comparing
+spotify_urls with the code it replaced: regexes compiled on every call (validate_spotify_url, the Spotify.*
+checks and the ID searches in the constructors) and a character by character sanitiser followed by re.sub.
+
+The regex cache in the re module is cleared between rounds for the legacy path. A run that touches more than
+_MAXCACHE distinct patterns (the ones in matching.py, youtube-search and tekore included) ends up recompiling them.
+
+    python benchmarks/url_parse_benchmark.py [--rounds 20000]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import const
+from spotify_urls import parse_spotify_url, sanitize_filename
+
+
+URLS = [
+    "https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=1b2c3d4e5f6a7b8c",
+    "https://open.spotify.com/album/1DFixLWuPkv3KT3TnV35m3",
+    "https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M?si=9f8e7d6c5b4a3921",
+]
+
+TITLES = [
+    "Don't Stop Me Now - Remastered 2011",
+    "Bohemian Rhapsody: \"Live Aid\" / 1985 *",
+    "Björk — Jóga (Howie B Main Mix)",
+    "AC/DC | Back In Black? <Official> ~ Remaster",
+]
+
+
+def legacy_validate(url):
+    if re.match(r"https://open\.spotify\.com/track/[A-Za-z0-9?=\-]+", url):
+        return "song"
+    elif re.match(r"https://open\.spotify\.com/playlist/[A-Za-z0-9?=[A-Za-z0-9&pt=[A-Za-z0-9\-]+", url):
+        return "private_playlist"
+    elif re.match(r"https://open\.spotify\.com/playlist/[A-Za-z0-9?=\-]+", url):
+        return "playlist"
+    elif re.match(r"https://open\.spotify\.com/album/[A-Za-z0-9?=\-]+", url):
+        return "album"
+
+def legacy_resource_id(url):
+    kind = legacy_validate(url)
+    kind = "track" if kind == "song" else "playlist" if kind == "private_playlist" else kind
+
+    # the Spotify.* check, then the ID search in the resource's constructor
+    re.match(r"https://open\.spotify\.com/" + kind + r"/[A-Za-z0-9?=\-]+", url)
+    return re.search(r"/" + kind + r"/([a-zA-Z0-9]+)", url).group(1)
+
+def legacy_sanitize(text):
+    text = "".join([current_character for current_character in text if current_character in const.LEGAL_PATH_CHARACTERS])
+    return re.sub(r'[\\/:*?"<>|]', '_', text)
+
+def current_resource_id(url):
+    return parse_spotify_url(url)[1]
+
+def time_calls(function, values, rounds, clear_re_cache=False):
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        if clear_re_cache:
+            re.purge()
+
+        for value in values:
+            function(value)
+
+    return (time.perf_counter() - start) / (rounds * len(values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the cost of parsing Spotify URLs and sanitising file names.")
+    parser.add_argument("--rounds", type=int, default=20000, help="Times every sample is processed")
+    args = parser.parse_args()
+
+    for url in URLS:
+        assert legacy_resource_id(url) == current_resource_id(url)
+    for title in TITLES:
+        assert legacy_sanitize(title) == sanitize_filename(title)
+
+    timings = [
+        ("parse URL, re cache warm", legacy_resource_id, current_resource_id, URLS, False),
+        ("parse URL, re cache cold", legacy_resource_id, current_resource_id, URLS, True),
+        ("sanitise file name", legacy_sanitize, sanitize_filename, TITLES, False),
+    ]
+
+    print(f"{'':<26}{'legacy us':>12}{'current us':>12}{'speedup':>10}")
+
+    for (name, legacy_function, current_function, values, clear_re_cache) in timings:
+        legacy_seconds = time_calls(legacy_function, values, args.rounds, clear_re_cache)
+        current_seconds = time_calls(current_function, values, args.rounds, clear_re_cache)
+
+        print(f"{name:<26}{legacy_seconds * 1e6:>12.2f}{current_seconds * 1e6:>12.2f}{legacy_seconds / current_seconds:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import const
+
+
+class MetadataCache():
+    """
+    SQLite backed store for Spotify metadata, keyed by resource kind and ID.
+
+    Entries can be validated either by a version string (e.g. a playlist snapshot_id) or by age.
+    """
+    def __init__(self, path=const.METADATA_CACHE_PATH, ttl=const.DEFAULT_METADATA_CACHE_TTL):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "kind TEXT NOT NULL, "
+            "resource_id TEXT NOT NULL, "
+            "version TEXT, "
+            "fetched_at REAL NOT NULL, "
+            "data TEXT NOT NULL, "
+            "PRIMARY KEY (kind, resource_id))"
+        )
+
+        # e.g. tracks cached before they carried their ID
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < const.METADATA_CACHE_FORMAT:
+            self.connection.execute("DELETE FROM metadata")
+            self.connection.execute(f"PRAGMA user_version = {const.METADATA_CACHE_FORMAT}")
+
+        self.connection.commit()
+
+    def get_entry(self, kind, resource_id):
+        """Return the raw (version, fetched_at, data) of an entry without validating it, or None if missing."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version, fetched_at, data FROM metadata WHERE kind = ? AND resource_id = ?",
+                (kind, resource_id)).fetchone()
+
+        if row is None:
+            return None
+
+        (cached_version, fetched_at, data) = row
+
+        return cached_version, fetched_at, json.loads(data)
+
+    def get(self, kind, resource_id, version=None):
+        """Return the cached data, or None if missing, from another version, or (for unversioned lookups) older than the TTL."""
+        entry = self.get_entry(kind, resource_id)
+
+        if entry is None:
+            return None
+
+        (cached_version, fetched_at, data) = entry
+
+        if version is not None:
+            if cached_version != version:
+                return None
+        elif self.ttl is not None and time.time() - fetched_at > self.ttl:
+            return None
+
+        return data
+
+    def get_many(self, kind, resource_ids):
+        """Return a dict of the cached data for every ID that has an entry younger than the TTL."""
+        found = {}
+
+        for resource_id in resource_ids:
+            data = self.get(kind, resource_id)
+            if data is not None:
+                found[resource_id] = data
+
+        return found
+
+    def set(self, kind, resource_id, data, version=None):
+        self.set_many(kind, [(resource_id, data)], version)
+
+    def set_many(self, kind, items, version=None):
+        now = time.time()
+        rows = [(kind, resource_id, version, now, json.dumps(data)) for (resource_id, data) in items]
+
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO metadata (kind, resource_id, version, fetched_at, data) VALUES (?, ?, ?, ?, ?)",
+                rows)
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class MatchCache():
+    """
+    SQLite backed store of the YouTube video each track resolved to, keyed by Spotify track ID and by the
+    normalised search query. Keeps the duration and view count the match was accepted on, so the length and
+    view count limits can be applied again without searching.
+    """
+    def __init__(self, path=const.MATCH_CACHE_PATH, ttl=const.DEFAULT_MATCH_CACHE_TTL):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS matches ("
+            "match_key TEXT PRIMARY KEY, "
+            "video_id TEXT NOT NULL, "
+            "title TEXT, "
+            "duration INTEGER NOT NULL, "
+            "views INTEGER NOT NULL, "
+            "resolved_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get(self, match_keys):
+        """Return the first match younger than the TTL for any of the keys, or None."""
+        oldest_allowed = time.time() - self.ttl if self.ttl is not None else 0
+
+        with self.lock:
+            for match_key in match_keys:
+                row = self.connection.execute(
+                    "SELECT video_id, title, duration, views FROM matches WHERE match_key = ? AND resolved_at >= ?",
+                    (match_key, oldest_allowed)).fetchone()
+
+                if row:
+                    (video_id, title, duration, views) = row
+                    return {"video_id": video_id, "title": title, "duration": duration, "views": views}
+
+        return None
+
+    def set(self, match_keys, video_id, title, duration, views):
+        now = time.time()
+
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO matches (match_key, video_id, title, duration, views, resolved_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(match_key, video_id, title, duration, views, now) for match_key in match_keys])
+            self.connection.commit()
+
+    def forget(self, match_keys):
+        with self.lock:
+            self.connection.executemany("DELETE FROM matches WHERE match_key = ?", [(match_key,) for match_key in match_keys])
+            self.connection.commit()
+
+    def entries(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT match_key, video_id, title, duration, views, resolved_at FROM matches ORDER BY resolved_at DESC").fetchall()
+
+    def stats(self):
+        oldest_allowed = time.time() - self.ttl if self.ttl is not None else 0
+
+        with self.lock:
+            (total, expired) = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(resolved_at < ?), 0) FROM matches", (oldest_allowed,)).fetchone()
+
+        return {"total": total, "expired": expired}
+
+    def prune(self):
+        """Delete the matches older than the TTL, returning how many were removed."""
+        oldest_allowed = time.time() - self.ttl if self.ttl is not None else 0
+
+        with self.lock:
+            removed = self.connection.execute("DELETE FROM matches WHERE resolved_at < ?", (oldest_allowed,)).rowcount
+            self.connection.commit()
+
+        return removed
+
+    def clear(self):
+        with self.lock:
+            removed = self.connection.execute("DELETE FROM matches").rowcount
+            self.connection.commit()
+
+        return removed
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -37,6 +37,89 @@ LEGAL_PATH_CHARACTERS = string.ascii_letters + string.digits+ " ()[]" + "_-.,&'!
 
 DEFAULT_MIN_VIEWS_FOR_DOWNLOAD = -1
 DEFAULT_MAX_LENGTH_FOR_DOWNLOAD = 60*30
+DEFAULT_WORKER_COUNT = 4
+DEFAULT_QUEUE_SIZE = 8
+PIPELINE_STAGES = ("search", "fetch", "transcode", "tag")
+# what the run report times for every track, cover_art is fetched while tagging but timed on its own
+METRICS_STAGES = ("spotify_load", "youtube_search", "stream_download", "transcode", "cover_art", "tag_write")
+
+SPOTIFY_TRACKS_BATCH_SIZE = 50
+# pages of a playlist, album or the liked songs fetched at the same time in async loading mode
+SPOTIFY_PAGE_CONCURRENCY = 8
+
+# how much each signal counts towards a YouTube result's match score (they add up to 1)
+MATCH_SCORE_WEIGHTS = {
+    "title": 0.35,
+    "artist": 0.20,
+    "duration": 0.30,
+    "views": 0.10,
+    "channel": 0.05,
+}
+# a result this many seconds longer or shorter than the Spotify track gets no duration score
+MATCH_DURATION_TOLERANCE = 30
+# a file already on disk is only taken as a finished download of a song if it's this many seconds as long
+EXISTING_FILE_DURATION_TOLERANCE = 5
+# view counts are scored on a log scale up to this many views
+MATCH_VIEWS_CEILING = 10 ** 9
+# words that mean a different recording when they're in the video title but not in the Spotify title
+MATCH_UNWANTED_KEYWORDS = ("live", "cover", "remix", "karaoke", "instrumental", "acoustic", "nightcore", "sped up", "slowed", "8d", "reaction", "lyrics video")
+MATCH_UNWANTED_KEYWORD_PENALTY = 0.25
+# an ISRC search result has to score at least this much to be used without falling back to a title search
+MATCH_ISRC_MIN_SCORE = 0.6
+
+CACHE_FOLDER = "cache/"
+METADATA_CACHE_PATH = CACHE_FOLDER + "metadata.sqlite"
+# raised whenever what's stored in the metadata cache changes, a cache written in an older format is emptied
+METADATA_CACHE_FORMAT = 1
+DEFAULT_METADATA_CACHE_TTL_DAYS = 7
+DEFAULT_METADATA_CACHE_TTL = DEFAULT_METADATA_CACHE_TTL_DAYS * 24 * 60 * 60
+MATCH_CACHE_PATH = CACHE_FOLDER + "matches.sqlite"
+DEFAULT_MATCH_CACHE_TTL_DAYS = 30
+DEFAULT_MATCH_CACHE_TTL = DEFAULT_MATCH_CACHE_TTL_DAYS * 24 * 60 * 60
+# the Spotify access token (valid for an hour) is kept between runs and refreshed this many seconds before it expires
+TOKEN_CACHE_PATH = CACHE_FOLDER + "token.json"
+TOKEN_REFRESH_MARGIN = 300
+
+OUTPUT_FORMATS = ("mp3", "m4a", "opus")
+DEFAULT_OUTPUT_FORMAT = "mp3"
+# YouTube serves AAC audio in mp4 and Opus audio in webm, so those streams can be remuxed without re-encoding
+PASSTHROUGH_SOURCE_EXTENSIONS = {
+    "m4a": ("mp4", "m4a"),
+    "opus": ("webm", "opus"),
+}
+PREFERRED_STREAM_SUBTYPES = {
+    "m4a": "mp4",
+    "opus": "webm",
+}
+
+DEFAULT_HTTP_TIMEOUT = 30
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+HTTP_POOL_HOSTS = 16
+
+# (requests per second, burst) allowed to each upstream host before the limiter adapts to what it tolerates
+RATE_LIMITS = {
+    "api.spotify.com": (10, 20),
+    "accounts.spotify.com": (2, 5),
+    "www.youtube.com": (5, 10),
+    "googlevideo.com": (20, 40),
+    "i.scdn.co": (20, 40),
+}
+DEFAULT_RATE_LIMIT = (10, 20)
+RATE_LIMIT_MIN_RATE = 0.2
+RATE_LIMIT_BACKOFF_FACTOR = 0.5
+RATE_LIMIT_RECOVERY_STEP = 0.02
+RATE_LIMIT_BASE_BACKOFF = 1
+RATE_LIMIT_MAX_BACKOFF = 60
+RATE_LIMIT_MAX_RETRIES = 5
+
+STREAM_CHUNK_SIZE = 10 * 1024 * 1024
+PARTIAL_FILE_SUFFIX = ".partial"
+
+MANIFEST_PATH = "downloads/.manifest.sqlite"
+CONTENT_STORE_FOLDER = "downloads/.store/"
 
 UNKNOWN_ALBUM_COVER_URL = "https://github.com/couldbejake/spotify2mp3/blob/main/assets/unknown-song.png?raw=true"
+UNKNOWN_ALBUM_COVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "unknown-song.png")
+COVER_ART_CACHE_FOLDER = CACHE_FOLDER + "covers/"
+COVER_ART_CACHE_MAX_ENTRIES = 64
 HELP_URL = "https://github.com/couldbejake/spotify2mp3/issues"
@@ -0,0 +1,44 @@
+import os
+
+import const
+from utils import link_file, remove_partial_files
+
+
+class ContentStore():
+    """
+    One copy of every downloaded song, named after its Spotify track ID, that collection folders link to.
+
+    A song that is on an album, in two playlists and in the liked songs is searched for, downloaded and converted
+    once. The store's files are recorded in the download manifest like any other folder, so a stored song is only
+    reused while it is intact.
+    """
+    def __init__(self, manifest, folder=const.CONTENT_STORE_FOLDER):
+        self.manifest = manifest
+        self.folder = folder
+
+        os.makedirs(self.folder, exist_ok=True)
+        remove_partial_files(self.folder)
+
+    def path_for(self, track_id, output_format):
+        return os.path.join(self.folder, track_id + "." + output_format)
+
+    def find(self, track_id, isrc, output_format):
+        """Return the manifest entry of the stored copy of a track (or of the same recording), or None."""
+        entry = self.manifest.find(track_id, isrc, self.folder)
+
+        if entry is None or not entry["output_path"].endswith("." + output_format) or not self.manifest.is_intact(entry):
+            return None
+
+        return entry
+
+    def add(self, track_id, isrc, finished_path, output_format, video_id=None, bitrate=None):
+        """Move a finished file into the store, returning its path there."""
+        stored_path = self.path_for(track_id, output_format)
+
+        os.replace(finished_path, stored_path)
+        self.manifest.record(track_id, isrc, self.folder, stored_path, video_id, bitrate)
+
+        return stored_path
+
+    def link(self, stored_path, track_path):
+        link_file(stored_path, track_path)
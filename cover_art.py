@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import const
+from exceptions import CoverArtUnavailable
+
+
+class CoverArtCache():
+    """
+    Album cover images keyed by URL. Recently used images are kept in memory (up to max_entries) in front
+    of a folder of files named after the SHA-1 of their URL, so each cover is downloaded once across runs.
+    """
+    def __init__(self, folder=const.COVER_ART_CACHE_FOLDER, max_entries=const.COVER_ART_CACHE_MAX_ENTRIES):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+        self.url_locks = {}
+
+    def get(self, image_url):
+        # the placeholder cover ships with the project, there's no need to fetch it from GitHub
+        if not image_url or image_url == const.UNKNOWN_ALBUM_COVER_URL:
+            image_url = const.UNKNOWN_ALBUM_COVER_URL
+            return self.get_or_load(image_url, lambda: read_file(const.UNKNOWN_ALBUM_COVER_PATH))
+
+        try:
+            return self.get_or_load(image_url, lambda: self.load(image_url))
+        except CoverArtUnavailable as e:
+            # the song is tagged with the placeholder rather than skipped, the next track of the album tries the real cover again
+            print(f"{const.colours.WARNING}[!] {e}, using the placeholder cover.{const.colours.ENDC}")
+            return self.get(None)
+
+    def get_or_load(self, image_url, loader):
+        image_data = self.get_from_memory(image_url)
+        if image_data is not None:
+            return image_data
+
+        # tracks of the same album are tagged at the same time, only the first one should fetch the cover
+        with self.url_lock(image_url):
+            image_data = self.get_from_memory(image_url)
+
+            if image_data is None:
+                image_data = loader()
+                self.add_to_memory(image_url, image_data)
+
+        return image_data
+
+    def load(self, image_url):
+        image_path = os.path.join(self.folder, hashlib.sha1(image_url.encode("utf-8")).hexdigest())
+
+        if os.path.exists(image_path):
+            return read_file(image_path)
+
+        # the HTTP clients are only loaded once a cover actually has to be downloaded
+        from requests import RequestException
+        from transport import transport
+
+        try:
+            response = transport.session().get(image_url)
+            response.raise_for_status()
+        except RequestException as e:
+            raise CoverArtUnavailable(f"Could not download the cover art at {image_url} ({e})")
+
+        image_data = response.content
+
+        os.makedirs(self.folder, exist_ok=True)
+        partial_path = image_path + const.PARTIAL_FILE_SUFFIX
+        with open(partial_path, "wb") as image_file:
+            image_file.write(image_data)
+        os.replace(partial_path, image_path)
+
+        return image_data
+
+    def get_from_memory(self, image_url):
+        with self.lock:
+            image_data = self.images.get(image_url)
+
+            if image_data is not None:
+                self.images.move_to_end(image_url)
+
+            return image_data
+
+    def add_to_memory(self, image_url, image_data):
+        with self.lock:
+            self.images[image_url] = image_data
+            self.images.move_to_end(image_url)
+
+            while len(self.images) > self.max_entries:
+                self.images.popitem(last=False)
+
+    def url_lock(self, image_url):
+        with self.lock:
+            if image_url not in self.url_locks:
+                self.url_locks[image_url] = threading.Lock()
+
+            return self.url_locks[image_url]
+
+
+def read_file(file_path):
+    with open(file_path, "rb") as image_file:
+        return image_file.read()
+
+def image_mime_type(image_data):
+    """Spotify covers are JPEGs, the bundled placeholder is a PNG."""
+    if image_data.startswith(b"\x89PNG"):
+        return "image/png"
+
+    return "image/jpeg"
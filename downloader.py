@@ -1,47 +1,71 @@
 import sys
 import os
 import shutil
-import time
 import string
 from pathlib import Path
-import ssl
-import re
+import threading
 
-from const import colours
+from const import colours, LIKED_KEYWORD, DEFAULT_WORKER_COUNT, DEFAULT_QUEUE_SIZE, DEFAULT_OUTPUT_FORMAT, PIPELINE_STAGES, PREFERRED_STREAM_SUBTYPES, EXISTING_FILE_DURATION_TOLERANCE
 from pytubefix.exceptions import AgeRestrictedError
-from exceptions import SpotifyAlbumNotFound, SpotifyTrackNotFound, SpotifyPlaylistNotFound, ConfigVideoMaxLength, ConfigVideoLowViewCount, YoutubeItemNotFound
+from exceptions import InvalidSpotifyURL, SpotifyAlbumNotFound, SpotifyTrackNotFound, SpotifyPlaylistNotFound, SpotifyRetrievalError, ConfigVideoMaxLength, ConfigVideoLowViewCount, YoutubeItemNotFound
 from apis.spotify import Spotify
-from apis.youtube import YouTube
-from utils import resave_audio_clip_with_metadata
-
-ssl._create_default_https_context = ssl._create_stdlib_context
+from apis.youtube import YouTube, get_video_id
+from pipeline import Pipeline, PipelineJob
+from metrics import TrackMetrics, run_metrics
+from utils import transcode_audio_clip, write_audio_metadata, partial_path_for, remove_partial_files, can_passthrough, link_file, read_audio_info
+
+class TrackJob(PipelineJob):
+    def __init__(self, track, idx, idx_max, output_path, metrics=None):
+        super().__init__()
+        self.track = track
+        self.idx = idx
+        self.idx_max = idx_max
+        self.output_path = output_path
+        self.track_path = None
+        self.youtube_link = None
+        self.downloaded_path = None
+        self.transcoded_path = None
+        self.audio_quality = None
+        self.existing_path = None
+        # (output folder, metrics) of the other collections this song is also in, linked once it's done
+        self.linked_outputs = []
+        self.metrics = metrics or TrackMetrics()
 
 class SpotifyDownloader():
-    def __init__(self, spotify: Spotify, youtube: YouTube, audio_quality=1000000, max_length=60*30, min_view_count=10000):
+    def __init__(self, spotify: Spotify, youtube: YouTube, audio_quality=1000000, max_length=60*30, min_view_count=10000, workers=DEFAULT_WORKER_COUNT, stage_workers=None, queue_size=DEFAULT_QUEUE_SIZE, show_queue_depths=False, manifest=None, output_format=DEFAULT_OUTPUT_FORMAT, content_store=None):
         self.spotify_client = spotify
         self.youtube_client = youtube
         self.audio_quality = audio_quality
         self.max_length = max_length
         self.min_view_count = min_view_count
+        self.workers = max(1, workers)
+        self.stage_workers = self.get_stage_workers(stage_workers or {})
+        self.queue_size = queue_size
+        self.show_queue_depths = show_queue_depths
+        self.manifest = manifest
+        self.output_format = output_format
+        self.content_store = content_store
+        self.pipeline = None
+        self.print_lock = threading.Lock()
+        self.link_lock = threading.Lock()
+        self.open_jobs = {}
+        self.failed_jobs = []
+        self.failed_collections = []
+
+    def get_stage_workers(self, stage_workers):
+        # searching and fetching wait on the network, converting is bound by the number of cores and tagging by the disk
+        defaults = {
+            "search": self.workers,
+            "fetch": self.workers,
+            "transcode": min(self.workers, os.cpu_count() or 1),
+            "tag": 1,
+        }
+
+        return {stage: stage_workers.get(stage) or defaults[stage] for stage in PIPELINE_STAGES}
 
     def download_album(self, playlist_url):
-        skipped_songs = 0
-
-        print(f"\n{colours.OKBLUE}[!] Retrieving spotify album")
-
         try:
-            album = self.spotify_client.album(playlist_url)
-
-            self.prep_folder("downloads/albums/" + album.get_title(True))
-
-            tracks = album.get_tracks()
-
-            print(f"\n{colours.OKBLUE}[!] Found {len(tracks)} tracks in album.")
-            
-            time.sleep(3)
-
-            output_path = "downloads/albums/" + album.get_title(True) + "/"
-            self.download_tracks(output_path, tracks)
+            self.download_collections([self.load_album(playlist_url)])
 
             return True
         
@@ -49,21 +73,14 @@ class SpotifyDownloader():
             print(f"\n{colours.FAIL}Error: {colours.ENDC}{colours.WARNING}It's probably that this album does not exist {colours.ENDC} (e: {e}).{colours.ENDC}\n")
             sys.exit(1)
     
-    def download_liked_songs(self):
-        print(f"\n{colours.OKBLUE}[!] Retrieving liked songs from Spotify (many songs will take time)")
-
+    def download_liked_songs(self, incremental=False):
         try:
-            likedplaylist = self.spotify_client.likedSongs()
+            (output_path, tracks, total, likedplaylist) = self.load_liked_songs(incremental)
 
-            self.prep_folder("downloads/liked/" + likedplaylist.get_title(True))
+            self.download_collections([(output_path, tracks, total)])
 
-            tracks = likedplaylist.get_tracks()
-
-            print(f"\n{colours.OKBLUE}[!] Found {len(tracks)} liked tracks.")
-            time.sleep(3)
-
-            output_path = "downloads/liked/" + likedplaylist.get_title(True) + "/"
-            self.download_tracks(output_path, tracks)
+            if incremental:
+                likedplaylist.save_sync_point(self.failed_track_ids(output_path))
 
             return True
        
@@ -72,104 +89,353 @@ class SpotifyDownloader():
             sys.exit(1)
         
     def download_playlist(self, playlist_url):
-        print(f"\n{colours.OKBLUE}[!] Retrieving spotify playlist (large playlists will take time)")
-
         try:
-            playlist = self.spotify_client.playlist(playlist_url)
-
-            self.prep_folder("downloads/playlists/" + playlist.get_title(True))
-
-            tracks = playlist.get_tracks()
-
-            print(f"\n{colours.OKBLUE}[!] Found {len(tracks)} tracks in playlist.")
-            time.sleep(3)
-
-            output_path = "downloads/playlists/" + playlist.get_title(True) + "/"
-            self.download_tracks(output_path, tracks)
+            self.download_collections([self.load_playlist(playlist_url)])
 
             return True
         
         except SpotifyPlaylistNotFound:
             print(f"\n{colours.FAIL}Error: {colours.ENDC}{colours.WARNING}It's probably that this playlist is private or does not exist. Re-run with --login to access private playlists.{colours.ENDC}\n")
             sys.exit(1)
-        
-    def download_tracks(self, output_path, tracks):
-        skipped_tracks = []
 
-        idx_max = len(tracks)
-        for i in range(idx_max):
+    def download_batch(self, collections, incremental=False):
+        """
+        Download several collections, given as (url type, url) pairs, through one pipeline. A song that is in more
+        than one of them is downloaded once and linked into the other folders.
+        """
+        loaded_collections = []
+        likedplaylist = None
+        liked_output_path = None
+
+        for (url_type, url) in collections:
             try:
-                track = tracks[i]
-                self.download_track(None, track, i, idx_max, output_path, True)
-
-            except SpotifyTrackNotFound as e:
-                print(f"   - {colours.WARNING}[!] Skipped a song we could not find.{colours.ENDC} {e}")
-                skipped_tracks.append((track, e))
-            
-            except YoutubeItemNotFound as e:
-                print(f"   - {colours.WARNING}[!] Skipped a song we found on Spotify but not on YouTube.{colours.ENDC}\n")
-                skipped_tracks.append((track, e))
-
-            except ConfigVideoMaxLength as e:
-                print(f"\n{colours.WARNING}[!] Skipped a song - The found song was longer than the configured max song length, {colours.ENDC}(use the cli to increase this).{colours.ENDC}\n")
-                skipped_tracks.append((track, e))
-            
-            except ConfigVideoLowViewCount as e:
-                print(f"\n{colours.WARNING}[!] Skipped a song - The found song had less views than the minimum view count, {colours.ENDC}(use the cli to increase this).\n")
-                skipped_tracks.append((track, e))
-
-            except AgeRestrictedError as e:
-                print(f"   - {colours.FAIL}[!] Skipped a song - Age restricted video.{colours.ENDC} {e}")
-                skipped_tracks.append((track, e))
+                if url_type == "song":
+                    self.prep_folder("downloads/tracks/")
+                    loaded_collections.append(("downloads/tracks/", [self.spotify_client.track(url)], 1))
+                elif url_type == "album":
+                    loaded_collections.append(self.load_album(url))
+                elif url_type in ("playlist", "private_playlist"):
+                    loaded_collections.append(self.load_playlist(url))
+                elif url_type == LIKED_KEYWORD:
+                    (liked_output_path, tracks, total, likedplaylist) = self.load_liked_songs(incremental)
+                    loaded_collections.append((liked_output_path, tracks, total))
 
-            except Exception as e:
-                print(f"   - {colours.FAIL}[!] Skipped a song - Something went wrong.{colours.ENDC} {e}")
-                skipped_tracks.append((track, e))
+            except (InvalidSpotifyURL, SpotifyAlbumNotFound, SpotifyPlaylistNotFound, SpotifyTrackNotFound, SpotifyRetrievalError) as e:
+                print(f"\n{colours.WARNING}[!] Skipping {url}{colours.ENDC} (e: {e}).")
+
+        if len(loaded_collections) < 1:
+            return False
+
+        self.download_collections(loaded_collections)
+
+        if incremental and likedplaylist:
+            likedplaylist.save_sync_point(self.failed_track_ids(liked_output_path))
+
+        return True
+
+    def failed_track_ids(self, output_path):
+        """IDs of the songs of the last run that weren't downloaded into output_path."""
+        return [job.track.resource_id for job in self.failed_jobs if job.output_path == output_path]
+
+    def load_album(self, album_url):
+        print(f"\n{colours.OKBLUE}[!] Retrieving spotify album")
+
+        album = self.spotify_client.album(album_url)
+
+        self.prep_folder("downloads/albums/" + album.get_title(True))
+
+        total = album.get_total()
+
+        print(f"\n{colours.OKBLUE}[!] Found {total} tracks in album.")
+
+        # tracks are paged while the first ones download
+        return "downloads/albums/" + album.get_title(True) + "/", album.iter_tracks(), total
+
+    def load_liked_songs(self, incremental=False):
+        print(f"\n{colours.OKBLUE}[!] Retrieving liked songs from Spotify (many songs will take time)")
+
+        likedplaylist = self.spotify_client.likedSongs(incremental)
+
+        self.prep_folder("downloads/liked/" + likedplaylist.get_title(True))
+
+        total = likedplaylist.get_total()
+
+        if incremental and likedplaylist.get_sync_point():
+            print(f"\n{colours.OKBLUE}[!] Found {total} liked tracks since the last sync.")
+        else:
+            print(f"\n{colours.OKBLUE}[!] Found {total} liked tracks.")
+
+        return "downloads/liked/" + likedplaylist.get_title(True) + "/", likedplaylist.iter_tracks(), total, likedplaylist
+
+    def load_playlist(self, playlist_url):
+        print(f"\n{colours.OKBLUE}[!] Retrieving spotify playlist (large playlists will take time)")
+
+        playlist = self.spotify_client.playlist(playlist_url)
+
+        self.prep_folder("downloads/playlists/" + playlist.get_title(True))
+
+        total = playlist.get_total()
+
+        print(f"\n{colours.OKBLUE}[!] Found {total} tracks in playlist.")
+
+        return "downloads/playlists/" + playlist.get_title(True) + "/", playlist.iter_tracks(), total
+
+    def download_tracks(self, output_path, tracks):
+        return self.download_collections([(output_path, tracks, len(tracks))])
+
+    def download_collections(self, collections):
+        """
+        Download the tracks of one or more (output folder, tracks, total) collections, returning the skipped (track, reason)
+        pairs. The tracks can be generators, they're only consumed as fast as the pipeline takes on new jobs.
+        """
+        counts = {"completed": 0, "linked": 0}
+        self.failed_jobs = []
+        self.failed_collections = []
+
+        jobs = self.generate_jobs(collections, counts)
+
+        if self.workers > 1:
+            self.run_pipeline(jobs)
+        else:
+            for job in jobs:
+                self.try_download_job(job)
+
+        if counts["completed"] > 0:
+            print(f"\n{colours.OKCYAN}[!] {counts['completed']} tracks were already downloaded, they were skipped.{colours.ENDC}")
+
+        if counts["linked"] > 0:
+            print(f"\n{colours.OKCYAN}[!] {counts['linked']} songs were in more than one collection, they were only downloaded once.{colours.ENDC}")
+
+        skipped_tracks = [(job.track, job.error) for job in self.failed_jobs]
 
         if len(skipped_tracks) > 0:
             print(f"\n{colours.WARNING}[!] Skipped {len(skipped_tracks)} songs.{colours.ENDC}\n")
             for (track, reason) in skipped_tracks:
                 print(f"    {track.get_title(True)} {colours.WARNING}[{reason}]{colours.ENDC}")
 
+        if len(self.failed_collections) > 0:
+            print(f"\n{colours.WARNING}[!] {len(self.failed_collections)} collections could not be loaded to the end, the songs after the failure were not downloaded.{colours.ENDC}\n")
+            for (output_path, reason) in self.failed_collections:
+                print(f"    {output_path} {colours.WARNING}[{reason}]{colours.ENDC}")
+
         return skipped_tracks
 
+    def generate_jobs(self, collections, counts):
+        """Yield a job for every track that still has to be downloaded, numbered by its position across all the collections."""
+        idx_max = sum(total for (_, _, total) in collections)
+        idx = 0
+
+        for (output_path, tracks, _) in collections:
+            remove_partial_files(output_path)
+
+            completed = self.completed_entries(output_path)
+
+            # tracks are paged in while earlier ones download, a page that can't be loaded ends this collection but
+            # lets the songs already queued (and the other collections) finish
+            try:
+                # the time spent loading each track from Spotify (a whole page, for the first track of a page) is measured as it's paged in
+                for (track, metrics) in run_metrics.measure_iteration(tracks, "spotify_load"):
+                    idx += 1
+
+                    metrics.describe(track, output_path)
+                    run_metrics.add_track(metrics)
+
+                    if completed and self.is_completed(self.find_completed_entry(track, completed)):
+                        counts["completed"] += 1
+                        metrics.outcome = "already downloaded"
+                        run_metrics.finish_track(metrics)
+                        continue
+
+                    job = self.job_for_track(track, idx - 1, max(idx_max, idx), output_path, counts, metrics)
+                    if job is not None:
+                        yield job
+                    else:
+                        metrics.outcome = "linked"
+
+            except SpotifyRetrievalError as e:
+                self.log(f"\n{colours.WARNING}[!] Stopped loading {output_path} from Spotify.{colours.ENDC} (e: {e})")
+                self.failed_collections.append((output_path, e))
+
+    def job_for_track(self, track, idx, idx_max, output_path, counts, metrics=None):
+        """
+        Return a new job for a track, or None if a job for the same track is still running, in which case the
+        folder is added to the folders that job links the song into once it's done.
+        """
+        with self.link_lock:
+            first_job = self.open_jobs.get(track.resource_id)
+
+            if first_job is not None:
+                if output_path != first_job.output_path and output_path not in [linked_path for (linked_path, _) in first_job.linked_outputs]:
+                    first_job.linked_outputs.append((output_path, metrics))
+                    counts["linked"] += 1
+                return None
+
+            job = TrackJob(track, idx, idx_max, output_path, metrics)
+            self.open_jobs[track.resource_id] = job
+
+            return job
+
+    def close_job(self, job):
+        """
+        Stop adding folders to a job, returning the (output folder, metrics) of the other collections its song has to be
+        linked into. They're only handed out once, a second call returns nothing.
+        """
+        with self.link_lock:
+            if self.open_jobs.get(job.track.resource_id) is job:
+                del self.open_jobs[job.track.resource_id]
+
+            linked_outputs = job.linked_outputs
+            job.linked_outputs = []
+
+            return linked_outputs
+
+    def finish_linked_outputs(self, job):
+        """
+        Deal with the other collections a job's song is in once the job is over. The tag stage normally links them, but
+        a job that failed or found the song already downloaded still has them: they're linked to the existing file, or
+        skipped with the job's error.
+        """
+        linked_outputs = self.close_job(job)
+
+        for (output_path, metrics) in linked_outputs:
+            if job.error is None and job.existing_path:
+                self.link_output(job, job.existing_path, output_path, metrics)
+                continue
+
+            linked_job = TrackJob(job.track, job.idx, job.idx_max, output_path, metrics)
+            linked_job.error = job.error or Exception("The song wasn't downloaded for another collection")
+            self.record_outcome(linked_job)
+            self.failed_jobs.append(linked_job)
+
+    def completed_entries(self, output_path):
+        """The manifest entries of a folder by track id and by ISRC, loaded with one query for the whole collection."""
+        if not self.manifest:
+            return None
+
+        completed = self.manifest.completed_tracks(output_path)
+        completed_by_isrc = {entry["isrc"]: entry for entry in completed.values() if entry["isrc"]}
+
+        return completed, completed_by_isrc
+
+    def find_completed_entry(self, track, completed_entries):
+        (completed, completed_by_isrc) = completed_entries
+
+        return completed.get(track.resource_id) or completed_by_isrc.get(track.isrc)
+
+    def is_completed(self, entry):
+        """Whether a manifest entry is a finished download in the format currently being downloaded."""
+        return entry is not None and entry["output_path"].endswith("." + self.output_format) and self.manifest.is_intact(entry)
+
+    def run_pipeline(self, jobs):
+        """Run jobs through the search, fetch, transcode and tag stages concurrently. Skipped jobs are left with their error set."""
+        self.pipeline = Pipeline(on_done=self.finish_job)
+        self.pipeline.add_stage("search", self.search_stage, self.stage_workers["search"], self.queue_size)
+        self.pipeline.add_stage("fetch", self.fetch_stage, self.stage_workers["fetch"], self.queue_size)
+        self.pipeline.add_stage("transcode", self.transcode_stage, self.stage_workers["transcode"], self.queue_size)
+        self.pipeline.add_stage("tag", self.tag_stage, self.stage_workers["tag"], self.queue_size)
+        self.pipeline.run(jobs)
+
+        if self.show_queue_depths:
+            print(f"\n{colours.OKBLUE}[!] Deepest queues: {self.format_queue_depths(self.pipeline.max_queue_depths())}{colours.ENDC}")
+
+        self.pipeline = None
+
+    def finish_job(self, job):
+        self.finish_linked_outputs(job)
+        self.record_outcome(job)
+
+        if job.error is not None:
+            self.failed_jobs.append(job)
+            self.remove_transcoded_file(job)
+            self.print_skip_reason(job.error, job.idx, job.idx_max)
+
+        if self.show_queue_depths and self.pipeline:
+            self.log(f"{colours.OKBLUE}   - Queues: {self.format_queue_depths(self.pipeline.queue_depths())}{colours.ENDC}", job.idx, job.idx_max)
+
+    def format_queue_depths(self, depths):
+        return ", ".join([f"{stage} {depth}" for stage, depth in depths.items()])
+
+    def try_download_job(self, job):
+        """Download a single track of a collection, leaving the reason it was skipped in job.error."""
+        try:
+            self.run_stages(job)
+        except Exception as e:
+            job.error = e
+            self.failed_jobs.append(job)
+            self.print_skip_reason(e, job.idx, job.idx_max)
+        finally:
+            self.finish_linked_outputs(job)
+            self.record_outcome(job)
+
+    def record_outcome(self, job):
+        if job.error is not None:
+            job.metrics.outcome = "failed"
+            job.metrics.error = str(job.error)
+        else:
+            # jobs that finish early found the song already downloaded, here or for another collection
+            job.metrics.outcome = "downloaded" if job.downloaded_path else "reused"
+
+        run_metrics.finish_track(job.metrics)
+
+    def run_stages(self, job):
+        try:
+            for stage in (self.search_stage, self.fetch_stage, self.transcode_stage, self.tag_stage):
+                stage(job)
+
+                if job.finished:
+                    break
+        except Exception:
+            self.remove_transcoded_file(job)
+            raise
+
+    def print_skip_reason(self, e, idx, idx_max):
+        if isinstance(e, SpotifyTrackNotFound):
+            self.log(f"   - {colours.WARNING}[!] Skipped a song we could not find.{colours.ENDC} {e}", idx, idx_max)
+        elif isinstance(e, YoutubeItemNotFound):
+            self.log(f"   - {colours.WARNING}[!] Skipped a song we found on Spotify but not on YouTube.{colours.ENDC}\n", idx, idx_max)
+        elif isinstance(e, ConfigVideoMaxLength):
+            self.log(f"\n{colours.WARNING}[!] Skipped a song - The found song was longer than the configured max song length, {colours.ENDC}(use the cli to increase this).{colours.ENDC}\n", idx, idx_max)
+        elif isinstance(e, ConfigVideoLowViewCount):
+            self.log(f"\n{colours.WARNING}[!] Skipped a song - The found song had less views than the minimum view count, {colours.ENDC}(use the cli to increase this).\n", idx, idx_max)
+        elif isinstance(e, AgeRestrictedError):
+            self.log(f"   - {colours.FAIL}[!] Skipped a song - Age restricted video.{colours.ENDC} {e}", idx, idx_max)
+        else:
+            self.log(f"   - {colours.FAIL}[!] Skipped a song - Something went wrong.{colours.ENDC} {e}", idx, idx_max)
+
+    def log(self, message, idx=0, idx_max=0):
+        """Print a line of per-track output, tagged with the track number when several tracks run at once."""
+        if self.workers > 1 and idx_max:
+            stripped_message = message.lstrip("\n")
+            message = message[:len(message) - len(stripped_message)] + f"{colours.ENDC}[{idx+1}/{idx_max}]" + stripped_message
+
+        with self.print_lock:
+            print(message)
+
     def download_track(self, track_url=None, track=None, idx=0, idx_max=0, output_path=None, as_sub_function=False):
         try:
             output_path = output_path if output_path else "downloads/tracks/"
 
+            metrics = TrackMetrics()
+
             if track_url:
-                track = self.spotify_client.track(track_url)
+                with run_metrics.measure(metrics, "spotify_load"):
+                    track = self.spotify_client.track(track_url)
             else:
                 if(track is None):
                     print("No Track was supplied to download track!")
                     raise Exception("No Track was supplied to download track!")
-                
-            if(track):
-                print(f"\n{colours.OKGREEN}Searching for song [{idx+1}/{idx_max}] {colours.ENDC}: {track.get_title(True)} by {track.get_artist()}")
-            
-            track_title = track.get_title(True)
-            track_title = re.sub(r'[\\/:*?"<>|]', '_', track_title)  # Sanitize the filename
-
-            track_path = output_path + track_title + ".mp3"
-
-            self.prep_folder(output_path)
-            if self.file_exists(track_path):
-                print(f"{colours.OKCYAN}   - File exists, skipping.")
-                return True
-                
-            searchable_name = track.get_searchable_title()
-
-            youtube_link = self.youtube_client.search( searchable_name, self.max_length, self.min_view_count )
 
-            print(f"{colours.ENDC}   - Downloading, please wait{colours.ENDC}")
+            metrics.describe(track, output_path)
+            run_metrics.add_track(metrics)
+            job = TrackJob(track, idx, idx_max, output_path, metrics)
 
-            video_downloaded_path, self.audio_quality = self.youtube_client.download(youtube_link, self.audio_quality)
-
-            print(f"{colours.ENDC}   - Converting the song and adding metadata{colours.ENDC}")
-
-            resave_audio_clip_with_metadata(video_downloaded_path, track.get_metadata(), output_path + track_title + ".mp3", self.audio_quality)
-
-            print(f"{colours.ENDC}   - Done!")
+            try:
+                self.run_stages(job)
+            except Exception as e:
+                job.error = e
+                raise
+            finally:
+                self.record_outcome(job)
 
             return True
 
@@ -194,6 +460,174 @@ class SpotifyDownloader():
             else:
                 raise e
 
+    def search_stage(self, job):
+        track = job.track
+
+        self.log(f"\n{colours.OKGREEN}Searching for song [{job.idx+1}/{job.idx_max}] {colours.ENDC}: {track.get_title(True)} by {track.get_artist()}")
+
+        self.prep_folder(job.output_path)
+
+        if self.manifest:
+            entry = self.manifest.find(track.resource_id, track.isrc, job.output_path)
+
+            if self.is_completed(entry):
+                self.log(f"{colours.OKCYAN}   - Already downloaded, skipping.{colours.ENDC}", job.idx, job.idx_max)
+                job.youtube_link = "https://www.youtube.com/watch?v=" + entry["video_id"] if entry["video_id"] else None
+                job.audio_quality = entry["bitrate"]
+                job.existing_path = entry["output_path"]
+                job.finished = True
+                return
+
+            # a file downloaded before there was a manifest is taken over rather than downloaded again
+            adopt_existing_file = entry is None
+        else:
+            adopt_existing_file = False
+
+        job.track_path = self.choose_track_path(track, job.output_path)
+
+        if not self.manifest and self.file_exists(job.track_path):
+            self.log(f"{colours.OKCYAN}   - File exists, skipping.{colours.ENDC}", job.idx, job.idx_max)
+            job.existing_path = job.track_path
+            job.finished = True
+            return
+
+        if adopt_existing_file and self.is_existing_download(job):
+            self.log(f"{colours.OKCYAN}   - File exists, adding it to the manifest and skipping.{colours.ENDC}", job.idx, job.idx_max)
+            self.record_download(job, job.output_path, job.track_path)
+            job.existing_path = job.track_path
+            job.finished = True
+            return
+
+        if self.content_store:
+            stored_entry = self.content_store.find(track.resource_id, track.isrc, self.output_format)
+
+            if stored_entry:
+                self.log(f"{colours.OKCYAN}   - Already downloaded for another collection, linking it.{colours.ENDC}", job.idx, job.idx_max)
+                job.youtube_link = "https://www.youtube.com/watch?v=" + stored_entry["video_id"] if stored_entry["video_id"] else None
+                job.audio_quality = stored_entry["bitrate"]
+                self.link_outputs(job, stored_entry["output_path"])
+                job.finished = True
+                return
+
+        searchable_name = track.get_searchable_title()
+
+        with run_metrics.measure(job.metrics, "youtube_search"):
+            job.youtube_link = self.youtube_client.search( searchable_name, self.max_length, self.min_view_count, track=track )
+
+    def is_existing_download(self, job):
+        """
+        Whether the file at the job's path is a finished download of this song: its length has to match the song's,
+        its size has to match its length (an mp3 states its full length even when it's cut short) and, when it has
+        one, its title tag has to match.
+        """
+        if not self.file_exists(job.track_path):
+            return False
+
+        info = read_audio_info(job.track_path)
+        track_seconds = job.track.duration_ms / 1000 if job.track.duration_ms else None
+
+        if info is None or track_seconds is None:
+            self.log(f"{colours.WARNING}   - The length of {job.track_path} can't be checked, downloading it again.{colours.ENDC}", job.idx, job.idx_max)
+            return False
+
+        (title, length, bitrate) = info
+
+        if title is not None and title != job.track.get_title():
+            self.log(f"{colours.WARNING}   - {job.track_path} holds another song ({title}), downloading this one again.{colours.ENDC}", job.idx, job.idx_max)
+            return False
+
+        # tags and cover art only add to the size, so a file smaller than its audio alone is cut short
+        if abs(length - track_seconds) > EXISTING_FILE_DURATION_TOLERANCE or os.path.getsize(job.track_path) < length * bitrate / 8 * 0.9:
+            self.log(f"{colours.WARNING}   - {job.track_path} isn't a finished download, downloading it again.{colours.ENDC}", job.idx, job.idx_max)
+            return False
+
+        return True
+
+    def choose_track_path(self, track, output_path):
+        # already stripped down to LEGAL_PATH_CHARACTERS, which has none of the characters Windows forbids
+        track_title = track.get_title(True)
+
+        if not self.manifest:
+            return output_path + track_title + "." + self.output_format
+
+        # songs sharing a title (e.g. two different "Intro"s) get the artist, then the track id, added to their file name
+        track_artist = track.get_artist(True)
+        return self.manifest.claim_path(track.resource_id, [
+            output_path + track_title + "." + self.output_format,
+            output_path + track_title + " - " + track_artist + "." + self.output_format,
+            output_path + track_title + " - " + track_artist + " (" + track.resource_id + ")." + self.output_format,
+        ])
+
+    def fetch_stage(self, job):
+        self.log(f"{colours.ENDC}   - Downloading, please wait{colours.ENDC}", job.idx, job.idx_max)
+
+        # the stream bitrate is per track, so don't overwrite the requested quality shared by every track
+        try:
+            with run_metrics.measure(job.metrics, "stream_download"):
+                job.downloaded_path, job.audio_quality = self.youtube_client.download(job.youtube_link, self.audio_quality, PREFERRED_STREAM_SUBTYPES.get(self.output_format))
+        except Exception:
+            # search again next time rather than retrying a video that can't be downloaded
+            self.youtube_client.forget_match(job.track.get_searchable_title(), job.track)
+            raise
+
+    def transcode_stage(self, job):
+        if can_passthrough(job.downloaded_path, self.output_format):
+            self.log(f"{colours.ENDC}   - Copying the audio without converting it{colours.ENDC}", job.idx, job.idx_max)
+        else:
+            self.log(f"{colours.ENDC}   - Converting the song{colours.ENDC}", job.idx, job.idx_max)
+
+        # converted next to its final path, so that moving it into place is atomic
+        job.transcoded_path = partial_path_for(self.content_store.path_for(job.track.resource_id, self.output_format) if self.content_store else job.track_path)
+        with run_metrics.measure(job.metrics, "transcode"):
+            transcode_audio_clip(job.downloaded_path, job.transcoded_path, job.audio_quality, self.output_format)
+
+    def tag_stage(self, job):
+        self.log(f"{colours.ENDC}   - Adding metadata{colours.ENDC}", job.idx, job.idx_max)
+
+        # fetching the cover art is measured on its own, inside this
+        with run_metrics.measure(job.metrics, "tag_write"):
+            write_audio_metadata(job.transcoded_path, job.track.get_metadata(), self.output_format)
+
+        if self.content_store:
+            stored_path = self.content_store.add(job.track.resource_id, job.track.isrc, job.transcoded_path, self.output_format,
+                                                 get_video_id(job.youtube_link), job.audio_quality)
+            self.link_outputs(job, stored_path)
+        else:
+            os.replace(job.transcoded_path, job.track_path)
+            self.record_download(job, job.output_path, job.track_path)
+
+            for (output_path, metrics) in self.close_job(job):
+                self.link_output(job, job.track_path, output_path, metrics)
+
+        self.log(f"{colours.ENDC}   - Done!", job.idx, job.idx_max)
+
+    def link_outputs(self, job, stored_path):
+        """Link a stored song into the job's own folder and every other collection folder it is in."""
+        self.content_store.link(stored_path, job.track_path)
+        self.record_download(job, job.output_path, job.track_path)
+
+        for (output_path, metrics) in self.close_job(job):
+            self.link_output(job, stored_path, output_path, metrics)
+
+    def link_output(self, job, source_path, output_path, metrics):
+        self.prep_folder(output_path)
+        linked_path = self.choose_track_path(job.track, output_path)
+
+        link_file(source_path, linked_path)
+        self.record_download(job, output_path, linked_path)
+        run_metrics.finish_track(metrics)
+
+        self.log(f"{colours.ENDC}   - Linked into {output_path}", job.idx, job.idx_max)
+
+    def record_download(self, job, output_path, track_path):
+        if self.manifest:
+            self.manifest.record(job.track.resource_id, job.track.isrc, output_path, track_path,
+                                 get_video_id(job.youtube_link) if job.youtube_link else None, job.audio_quality)
+
+    def remove_transcoded_file(self, job):
+        if job.transcoded_path and os.path.exists(job.transcoded_path):
+            os.remove(job.transcoded_path)
+
     def prep_folder(self, folder_name):
         Path(str(folder_name)).mkdir(parents=True, exist_ok=True)
         Path('temp/').mkdir(parents=True, exist_ok=True)
@@ -202,7 +636,8 @@ class SpotifyDownloader():
         return Path.exists(Path(str(file_path)))
 
     def rm_tmp_folder(self):
-        shutil.rmtree('./temp')
+        # nothing creates it when no collection could be loaded
+        shutil.rmtree('./temp', ignore_errors=True)
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -20,4 +20,10 @@ class SpotifyAlbumNotFound(Exception):
     pass
 
 class SpotifyRetrievalError(Exception):
+    pass
+
+class TranscodeError(Exception):
+    pass
+
+class CoverArtUnavailable(Exception):
     pass
\ No newline at end of file
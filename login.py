@@ -1,19 +1,16 @@
 import os
 import sys
+import json
+import time
 import tekore as tk
-from flask import Flask, request, redirect
 import threading
 import multiprocessing
 import webbrowser
 from time import sleep
 
-import requests
-import json
-from bs4 import BeautifulSoup
-
+import const
 from const import colours
-
-spotify = tk.Spotify()
+from transport import transport
 
 userToken = None # User token
 cred = None  # credentials object for doing token ops
@@ -50,17 +47,97 @@ A browser will open requesting permission. You will see the name of the applicat
 Press {colours.OKGREEN}enter{colours.OKBLUE} to continue{colours.ENDC}"""
 
 
+class CachedRefreshingToken(tk.RefreshingToken):
+    """
+    User token that refreshes itself a few minutes before it expires and saves every new access token to the
+    token cache, so the next run can reuse it instead of asking Spotify for one. Safe to share between threads.
+    """
+    def __init__(self, token, credentials, refresh_margin=const.TOKEN_REFRESH_MARGIN):
+        super().__init__(token, credentials)
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+
+    @property
+    def access_token(self):
+        with self.lock:
+            if self._token.expires_in < self.refresh_margin:
+                previous_refresh_token = self._token.refresh_token
+                self._token = self.credentials.refresh(self._token)
+
+                save_cached_token(self._token, previous_refresh_token)
+
+            return self._token.access_token
+
+
 # Token in the context of a user, can access user resources such as liked songs
 def get_user_token():
     (spotifyClientId, spotifyClientSecret, spotifyReturnUri,
         refreshToken) = tk.config_from_file(cfg_filename, return_refresh=True)
     cred = tk.Credentials(
-        spotifyClientId, spotifyClientSecret, spotifyReturnUri)
+        spotifyClientId, spotifyClientSecret, spotifyReturnUri, sender=transport.spotify_sender())
 
     if refreshToken is None or refreshToken == '':
         raise ValueError('RefreshToken not available in tekore config file')
 
-    return cred.refresh_user_token(refreshToken)
+    # an access token saved by an earlier run is reused while it has time left, the wrapper refreshes it after that
+    token = load_cached_token(refreshToken)
+
+    if token is None:
+        token = cred.refresh_user_token(refreshToken)
+        save_cached_token(token, refreshToken)
+
+    return CachedRefreshingToken(token, cred)
+
+def load_cached_token(refresh_token, path=const.TOKEN_CACHE_PATH):
+    """Return the saved access token for this refresh token, or None if there is none or it is about to expire."""
+    try:
+        with open(path, encoding="utf-8") as token_file:
+            token_info = json.load(token_file)
+    except (OSError, ValueError):
+        return None
+
+    # a different refresh token means the user logged in again since the access token was saved
+    if token_info.get("refresh_token") != refresh_token:
+        return None
+
+    expires_in = token_info["expires_at"] - int(time.time())
+    if expires_in < const.TOKEN_REFRESH_MARGIN:
+        return None
+
+    return tk.Token({
+        "access_token": token_info["access_token"],
+        "token_type": token_info["token_type"],
+        "scope": token_info["scope"],
+        "refresh_token": token_info["refresh_token"],
+        "expires_in": expires_in,
+    }, uses_pkce=False)
+
+def save_cached_token(token, previous_refresh_token=None, path=const.TOKEN_CACHE_PATH):
+    """Save an access token for later runs, readable by the current user only."""
+    # Spotify can hand out a new refresh token along with the access token, the old one may stop working
+    if previous_refresh_token and token.refresh_token != previous_refresh_token:
+        tk.config_to_file(cfg_filename, (None, None, None, token.refresh_token))
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    token_info = {
+        "access_token": token.access_token,
+        "token_type": token.token_type,
+        "scope": str(token.scope),
+        "refresh_token": token.refresh_token,
+        "expires_at": token.expires_at,
+    }
+
+    partial_path = path + const.PARTIAL_FILE_SUFFIX
+    with os.fdopen(os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as token_file:
+        json.dump(token_info, token_file)
+    os.replace(partial_path, path)
+
+def forget_cached_token(path=const.TOKEN_CACHE_PATH):
+    if os.path.exists(path):
+        os.remove(path)
 
 def is_user_logged_in():
     if not does_config_exist():
@@ -113,6 +190,7 @@ def do_user_login():
     except tk.HTTPError as e:
         if is_client_configured():
             os.remove(cfg_filename)
+        forget_cached_token()
         print(f'{colours.FAIL}Something went wrong. Your credentials have been reset. Try again.{colours.ENDC}{e}')
         sys.exit(1)
 
@@ -148,7 +226,10 @@ def stop_flask():
     pid = os.getpid()
     os.kill(pid, 9) # The second argument is the signal, 9 stands for SIGKILL.
 
-def app_factory() -> Flask:
+def app_factory():
+    # Flask is only needed for the one-off browser login, not for every download
+    from flask import Flask, request, redirect
+
     app = Flask(__name__)
     app.config['SECRET_KEY'] = __name__
 
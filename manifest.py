@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import const
+
+
+class DownloadManifest():
+    """
+    SQLite record of every finished download, keyed by Spotify track ID and output folder.
+
+    An entry is only written once the output file is complete, so an entry means the track is done and a
+    missing entry means it still has to be downloaded, whatever happens to be lying around on disk.
+    """
+    def __init__(self, path=const.MANIFEST_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.claimed_paths = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            "track_id TEXT NOT NULL, "
+            "output_folder TEXT NOT NULL, "
+            "isrc TEXT, "
+            "output_path TEXT NOT NULL, "
+            "video_id TEXT, "
+            "bitrate INTEGER, "
+            "size INTEGER NOT NULL, "
+            "checksum TEXT NOT NULL, "
+            "completed_at REAL NOT NULL, "
+            "PRIMARY KEY (track_id, output_folder))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS downloads_isrc ON downloads (isrc, output_folder)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS downloads_output_path ON downloads (output_path)")
+        self.connection.commit()
+
+    def completed_tracks(self, output_folder):
+        """Return {track_id: entry} for every track recorded in a folder, in a single query."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT track_id, isrc, output_path, video_id, bitrate, size, checksum FROM downloads WHERE output_folder = ?",
+                (normalise_folder(output_folder),)).fetchall()
+
+        return {row[0]: self.row_to_entry(row) for row in rows}
+
+    def find(self, track_id, isrc, output_folder):
+        """Return the entry for a track in a folder, matching by track ID first and then by ISRC."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT track_id, isrc, output_path, video_id, bitrate, size, checksum FROM downloads WHERE track_id = ? AND output_folder = ?",
+                (track_id, normalise_folder(output_folder))).fetchone()
+
+            if row is None and isrc:
+                row = self.connection.execute(
+                    "SELECT track_id, isrc, output_path, video_id, bitrate, size, checksum FROM downloads WHERE isrc = ? AND output_folder = ?",
+                    (isrc, normalise_folder(output_folder))).fetchone()
+
+        return self.row_to_entry(row) if row else None
+
+    def is_intact(self, entry):
+        """Cheap check that a recorded file is still there and hasn't been truncated or replaced."""
+        try:
+            return os.path.getsize(entry["output_path"]) == entry["size"]
+        except OSError:
+            return False
+
+    def claim_path(self, track_id, candidate_paths):
+        """
+        Reserve the first candidate path that no other track has been written to (or is being written to),
+        so that two different songs with the same title don't overwrite each other.
+        """
+        with self.lock:
+            for candidate_path in candidate_paths:
+                path_key = os.path.normpath(candidate_path)
+
+                owner = self.claimed_paths.get(path_key)
+                if owner is None:
+                    row = self.connection.execute(
+                        "SELECT track_id FROM downloads WHERE output_path = ? LIMIT 1", (path_key,)).fetchone()
+                    owner = row[0] if row else None
+
+                if owner is None or owner == track_id:
+                    self.claimed_paths[path_key] = track_id
+                    return candidate_path
+
+        raise ValueError(f"No free output path for track {track_id}: {candidate_paths}")
+
+    def record(self, track_id, isrc, output_folder, output_path, video_id=None, bitrate=None):
+        """Record a finished download. Call this only once output_path holds the complete file."""
+        size = os.path.getsize(output_path)
+        checksum = file_checksum(output_path)
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO downloads (track_id, output_folder, isrc, output_path, video_id, bitrate, size, checksum, completed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (track_id, normalise_folder(output_folder), isrc or None, os.path.normpath(output_path), video_id, bitrate, size, checksum, time.time()))
+            self.connection.commit()
+
+    def row_to_entry(self, row):
+        (track_id, isrc, output_path, video_id, bitrate, size, checksum) = row
+
+        return {
+            "track_id": track_id,
+            "isrc": isrc,
+            "output_path": output_path,
+            "video_id": video_id,
+            "bitrate": bitrate,
+            "size": size,
+            "checksum": checksum,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def normalise_folder(output_folder):
+    return os.path.normpath(output_folder)
+
+def file_checksum(file_path):
+    checksum = hashlib.sha256()
+
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
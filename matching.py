@@ -0,0 +1,103 @@
+import math
+import re
+
+from fuzzywuzzy import fuzz
+
+import const
+
+
+def normalise_text(text):
+    """Lowercase, drop punctuation and collapse whitespace so fuzzy comparisons only see the words."""
+    return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+def parse_duration(duration):
+    """Seconds in a YouTube search result duration such as "3:25" or "1:02:45", None for live streams."""
+    seconds = 0
+
+    for part in (duration or "").split(":"):
+        if not part.isdigit():
+            return None
+        seconds = seconds * 60 + int(part)
+
+    return seconds
+
+def parse_views(views):
+    digits = re.sub("[^0-9]", "", views or "")
+    return int(digits) if digits else 0
+
+
+class MatchTarget():
+    """What a YouTube result is compared with: the Spotify title, artists and duration of a track."""
+    def __init__(self, title, artists, duration_seconds=None):
+        self.title = normalise_text(title)
+        self.artists = [normalise_text(artist) for artist in artists if artist]
+        self.duration_seconds = duration_seconds
+
+    @classmethod
+    def from_track(cls, track):
+        return cls(track.title, track.artists, track.duration_ms / 1000 if track.duration_ms else None)
+
+    @classmethod
+    def from_query(cls, search_query):
+        return cls(search_query, [])
+
+
+class MatchCandidate():
+    """One YouTube search result, with the score it was given against a MatchTarget."""
+    def __init__(self, video):
+        self.video = video
+        self.title = video.get("title", "")
+        self.channel = video.get("channel", "")
+        self.duration = parse_duration(video["duration"])
+        self.views = parse_views(video.get("views"))
+        self.url_suffix = video["url_suffix"]
+        self.score = 0.0
+        self.signals = {}
+
+    def rate(self, target):
+        video_title = normalise_text(self.title)
+        channel = normalise_text(self.channel)
+
+        # token_set_ratio ignores extra words such as "(Official Video)" and the artist name in the title
+        self.signals["title"] = fuzz.token_set_ratio(target.title, video_title) / 100
+
+        if target.artists:
+            self.signals["artist"] = max(
+                max(fuzz.partial_ratio(artist, video_title), fuzz.partial_ratio(artist, channel)) for artist in target.artists) / 100
+        else:
+            self.signals["artist"] = self.signals["title"]
+
+        if target.duration_seconds is not None:
+            duration_delta = abs(self.duration - target.duration_seconds)
+            self.signals["duration"] = max(0.0, 1 - duration_delta / const.MATCH_DURATION_TOLERANCE)
+        else:
+            self.signals["duration"] = 0.5
+
+        self.signals["views"] = min(1.0, math.log10(self.views + 1) / math.log10(const.MATCH_VIEWS_CEILING))
+
+        # "Artist - Topic" channels are YouTube's auto-generated uploads of the studio recording
+        official_channel = channel.endswith(" topic") or "vevo" in channel
+        artist_channel = any(fuzz.ratio(artist, channel) >= 90 for artist in target.artists)
+        self.signals["channel"] = 1.0 if official_channel or artist_channel else 0.0
+
+        self.score = sum(const.MATCH_SCORE_WEIGHTS[signal] * value for (signal, value) in self.signals.items())
+
+        for keyword in const.MATCH_UNWANTED_KEYWORDS:
+            if has_word(video_title, keyword) and not has_word(target.title, keyword):
+                self.score -= const.MATCH_UNWANTED_KEYWORD_PENALTY
+
+        return self.score
+
+
+def has_word(text, word):
+    return re.search(r"\b" + re.escape(word) + r"\b", text) is not None
+
+def rank_candidates(videos, target):
+    """Score YouTube search results against a track, best match first."""
+    # live streams have no duration and can't be downloaded as a song
+    candidates = [MatchCandidate(video) for video in videos if parse_duration(video.get("duration")) is not None]
+
+    for candidate in candidates:
+        candidate.rate(target)
+
+    return sorted(candidates, key=lambda candidate: candidate.score, reverse=True)
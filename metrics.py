@@ -0,0 +1,253 @@
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import const
+
+
+class TrackMetrics():
+    """Wall time, bytes transferred and retries spent on one track in each stage of a run."""
+    def __init__(self):
+        self.track_id = None
+        self.title = None
+        self.collection = None
+        self.outcome = None
+        self.error = None
+        self.stages = {}
+
+    def describe(self, track, collection):
+        self.track_id = track.resource_id
+        self.title = track.get_searchable_title()
+        self.collection = collection
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {"seconds": 0.0, "bytes": 0, "retries": 0}
+
+        return self.stages[name]
+
+
+class StageFrame():
+    def __init__(self, record, entry):
+        self.record = record
+        self.entry = entry
+        self.nested_seconds = 0.0
+
+
+class RunMetrics():
+    """
+    Per track, per stage measurements for the whole run, shared by every thread.
+
+    A stage is measured with `with run_metrics.measure(record, stage):`. Code running inside it, however deep,
+    reports bytes and retries with add_bytes() and add_retry() without being handed the record, because each
+    thread keeps a stack of the stages it is in. A stage measured inside another (cover art fetched while
+    tagging) is not counted twice, the outer stage only keeps its own time.
+
+    Every track's record is only kept (for percentiles and the report) when keep_tracks is set. Otherwise a record
+    is added to running totals per stage and outcome once finish_track() is called with it, and then dropped.
+    """
+    def __init__(self):
+        self.tracks = []
+        self.keep_tracks = False
+        self.stage_totals = {}
+        self.outcome_counts = {}
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def frames(self):
+        if not hasattr(self.local, "frames"):
+            self.local.frames = []
+
+        return self.local.frames
+
+    def add_track(self, record):
+        if self.keep_tracks:
+            with self.lock:
+                self.tracks.append(record)
+
+        return record
+
+    def finish_track(self, record):
+        """Call once a track's stages are over and its outcome is set."""
+        if self.keep_tracks:
+            return
+
+        with self.lock:
+            for (stage, entry) in record.stages.items():
+                totals = self.stage_totals.setdefault(stage, {"tracks": 0, "total_seconds": 0.0, "bytes": 0, "retries": 0})
+                totals["tracks"] += 1
+                totals["total_seconds"] += entry["seconds"]
+                totals["bytes"] += entry["bytes"]
+                totals["retries"] += entry["retries"]
+
+            self.outcome_counts[record.outcome] = self.outcome_counts.get(record.outcome, 0) + 1
+
+    @contextmanager
+    def measure(self, record, stage):
+        frames = self.frames()
+        frame = StageFrame(record, record.stage(stage))
+        frames.append(frame)
+        start = time.perf_counter()
+
+        try:
+            yield frame.entry
+        finally:
+            elapsed = time.perf_counter() - start
+            frames.pop()
+
+            frame.entry["seconds"] += elapsed - frame.nested_seconds
+            if frames:
+                frames[-1].nested_seconds += elapsed
+
+    @contextmanager
+    def measure_nested(self, stage):
+        """Measure a stage for the track whose stage this thread is currently in, if there is one."""
+        frames = self.frames()
+
+        if not frames:
+            yield None
+            return
+
+        with self.measure(frames[-1].record, stage) as entry:
+            yield entry
+
+    def measure_iteration(self, items, stage):
+        """Yield (item, record) for every item of an iterator, with the time taken to produce it recorded as stage."""
+        iterator = iter(items)
+        end = object()
+
+        while True:
+            record = TrackMetrics()
+
+            with self.measure(record, stage):
+                item = next(iterator, end)
+
+            if item is end:
+                return
+
+            yield item, record
+
+    def add_bytes(self, byte_count):
+        frames = self.frames()
+        if frames:
+            frames[-1].entry["bytes"] += byte_count
+
+    def add_retry(self):
+        frames = self.frames()
+        if frames:
+            frames[-1].entry["retries"] += 1
+
+    def summary(self):
+        """
+        Percentiles of the time taken by each stage, with the total bytes and retries, in METRICS_STAGES order. The
+        percentiles are None when the tracks' records weren't kept.
+        """
+        if not self.keep_tracks:
+            with self.lock:
+                return {stage: dict(self.stage_totals[stage], p50=None, p90=None, p99=None, max=None)
+                        for stage in const.METRICS_STAGES if stage in self.stage_totals}
+
+        with self.lock:
+            tracks = list(self.tracks)
+
+        summary = {}
+
+        for stage in const.METRICS_STAGES:
+            entries = [record.stages[stage] for record in tracks if stage in record.stages]
+
+            if not entries:
+                continue
+
+            seconds = sorted(entry["seconds"] for entry in entries)
+
+            summary[stage] = {
+                "tracks": len(entries),
+                "total_seconds": sum(seconds),
+                "p50": percentile(seconds, 0.5),
+                "p90": percentile(seconds, 0.9),
+                "p99": percentile(seconds, 0.99),
+                "max": seconds[-1],
+                "bytes": sum(entry["bytes"] for entry in entries),
+                "retries": sum(entry["retries"] for entry in entries),
+            }
+
+        return summary
+
+    def outcomes(self):
+        if not self.keep_tracks:
+            with self.lock:
+                return dict(self.outcome_counts)
+
+        counts = {}
+
+        with self.lock:
+            for record in self.tracks:
+                counts[record.outcome] = counts.get(record.outcome, 0) + 1
+
+        return counts
+
+    def format_summary(self):
+        lines = [f"{'stage':<16}{'tracks':>8}{'total s':>10}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}{'max s':>9}{'MiB':>9}{'retries':>9}"]
+
+        for (stage, stats) in self.summary().items():
+            lines.append(
+                f"{stage:<16}{stats['tracks']:>8}{stats['total_seconds']:>10.1f}{format_seconds(stats['p50'])}{format_seconds(stats['p90'])}"
+                f"{format_seconds(stats['p99'])}{format_seconds(stats['max'])}{stats['bytes'] / 1024 / 1024:>9.1f}{stats['retries']:>9}")
+
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        """Write every track's measurements to path, as CSV (one row per track and stage) if it ends in .csv, else as JSON."""
+        with self.lock:
+            tracks = list(self.tracks)
+
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="", encoding="utf-8") as report_file:
+                writer = csv.writer(report_file)
+                writer.writerow(["track_id", "title", "collection", "outcome", "error", "stage", "seconds", "bytes", "retries"])
+
+                for record in tracks:
+                    for (stage, entry) in record.stages.items():
+                        writer.writerow([record.track_id, record.title, record.collection, record.outcome, record.error,
+                                         stage, f"{entry['seconds']:.4f}", entry["bytes"], entry["retries"]])
+            return
+
+        report = {
+            "started_at": self.started_at,
+            "wall_seconds": time.perf_counter() - self.started,
+            "outcomes": self.outcomes(),
+            "stages": self.summary(),
+            "tracks": [
+                {
+                    "track_id": record.track_id,
+                    "title": record.title,
+                    "collection": record.collection,
+                    "outcome": record.outcome,
+                    "error": record.error,
+                    "stages": record.stages,
+                }
+                for record in tracks
+            ],
+        }
+
+        with open(path, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+def format_seconds(seconds):
+    return f"{'-':>9}" if seconds is None else f"{seconds:>9.2f}"
+
+def percentile(sorted_values, fraction):
+    """Linearly interpolated percentile of an already sorted list."""
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+run_metrics = RunMetrics()
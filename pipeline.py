@@ -0,0 +1,117 @@
+import queue
+import threading
+
+from const import colours
+
+
+class PipelineJob():
+    """A unit of work travelling through the pipeline. Stages attach their results to it as attributes."""
+    def __init__(self):
+        self.error = None
+        self.finished = False
+
+
+class PipelineStage():
+    def __init__(self, name, handler, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.max_depth = 0
+        self.threads = []
+        self.remaining_workers = self.workers
+        self.lock = threading.Lock()
+
+    def put(self, job):
+        self.queue.put(job)
+
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+
+class Pipeline():
+    """
+    Runs jobs through a chain of stages. Every stage has its own bounded queue and its own pool of worker
+    threads, so a slow stage applies back pressure to the ones before it instead of buffering every job.
+
+    A job leaves the pipeline (and is handed to on_done) once it has passed the last stage, once a stage
+    raises (the exception is stored on job.error) or once a stage marks it as job.finished.
+    """
+    _STOP = object()
+
+    def __init__(self, on_done=None):
+        self.stages = []
+        self.on_done = on_done
+
+    def add_stage(self, name, handler, workers=1, queue_size=8):
+        self.stages.append(PipelineStage(name, handler, workers, queue_size))
+
+    def queue_depths(self):
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def max_queue_depths(self):
+        return {stage.name: stage.max_depth for stage in self.stages}
+
+    def run(self, jobs):
+        if not self.stages:
+            raise ValueError("Pipeline has no stages to run.")
+
+        for position, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(position,), daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+        # jobs can be a generator that pages its work in lazily, the bounded first queue keeps it from running ahead
+        try:
+            for job in jobs:
+                self.stages[0].put(job)
+        finally:
+            # if producing the jobs fails, let the jobs already queued finish before the error is raised
+            for _ in range(self.stages[0].workers):
+                self.stages[0].queue.put(self._STOP)
+
+            for stage in self.stages:
+                for thread in stage.threads:
+                    thread.join()
+
+    def _work(self, position):
+        stage = self.stages[position]
+        next_stage = self.stages[position + 1] if position + 1 < len(self.stages) else None
+
+        try:
+            while True:
+                job = stage.queue.get()
+
+                if job is self._STOP:
+                    break
+
+                try:
+                    stage.handler(job)
+                except Exception as e:
+                    job.error = e
+
+                if next_stage is None or job.error is not None or job.finished:
+                    self._finish(job)
+                else:
+                    next_stage.put(job)
+        finally:
+            # the last worker of a stage to stop passes the shutdown on to the next stage, even if this one died,
+            # otherwise the workers after it would wait forever and run() would never return
+            with stage.lock:
+                stage.remaining_workers -= 1
+                last_worker = stage.remaining_workers == 0
+
+            if last_worker and next_stage is not None:
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(self._STOP)
+
+    def _finish(self, job):
+        if not self.on_done:
+            return
+
+        # one job that can't be finished (e.g. a failed manifest write) mustn't take the worker down with it
+        try:
+            self.on_done(job)
+        except Exception as e:
+            print(f"{colours.FAIL}[!] Failed to finish a job: {e}{colours.ENDC}")
@@ -0,0 +1,136 @@
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+
+import const
+
+
+class TokenBucket():
+    """
+    Request budget for one upstream host: up to burst requests at once, refilled at rate requests per second.
+
+    The rate adapts to the host. Every throttled response halves it and every successful one wins a little of it
+    back, so a run settles just under the rate the host tolerates instead of at a fixed guess.
+    """
+    def __init__(self, rate, burst, min_rate=const.RATE_LIMIT_MIN_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        # last_refill is in the future while the bucket is paused, nothing is earned until then
+        if now > self.last_refill:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+    def reserve(self):
+        """
+        Take a token and return how many seconds to wait before using it. Never blocks, so threads can
+        time.sleep() the result and coroutines can asyncio.sleep() it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+
+            # tokens can go negative: the request borrows from the refill that's still to come
+            self.tokens -= 1
+
+            return max(0.0, self.last_refill - now) + max(0.0, -self.tokens) / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold every request to this host for the given number of seconds, e.g. for a Retry-After header."""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+
+            self.tokens = min(self.tokens, 0)
+            self.last_refill = max(self.last_refill, now + seconds)
+            self.rate = max(self.min_rate, self.rate * const.RATE_LIMIT_BACKOFF_FACTOR)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * const.RATE_LIMIT_RECOVERY_STEP)
+
+
+class RateLimiter():
+    """Token buckets for every upstream host, shared by all the threads (and coroutines) making requests."""
+    def __init__(self, limits=const.RATE_LIMITS, default_limit=const.DEFAULT_RATE_LIMIT):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urllib.parse.urlparse(url).hostname or ""
+
+        # stream downloads come from many numbered googlevideo.com hosts that share one budget
+        limit_key = next((domain for domain in self.limits if host == domain or host.endswith("." + domain)), host)
+
+        with self.lock:
+            if limit_key not in self.buckets:
+                (rate, burst) = self.limits.get(limit_key, self.default_limit)
+                self.buckets[limit_key] = TokenBucket(rate, burst)
+
+            return self.buckets[limit_key]
+
+    def reserve(self, url):
+        return self.bucket(url).reserve()
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    def succeeded(self, url):
+        self.bucket(url).succeeded()
+
+    def throttled(self, url, attempt, retry_after=None):
+        """Pause the host after a 429 response and slow it down. Returns the pause in seconds."""
+        delay = backoff_delay(attempt, retry_after)
+        self.bucket(url).pause(delay)
+        return delay
+
+
+def parse_retry_after(retry_after):
+    """Seconds to wait from a Retry-After header, which holds either a number of seconds or an HTTP date."""
+    if retry_after is None:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt (from 0), honouring Retry-After when the server sent one."""
+    retry_after_seconds = parse_retry_after(retry_after)
+    if retry_after_seconds is not None:
+        return retry_after_seconds
+
+    delay = min(const.RATE_LIMIT_MAX_BACKOFF, const.RATE_LIMIT_BASE_BACKOFF * 2 ** attempt)
+
+    # jitter so that workers throttled at the same moment don't all retry at the same moment
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def is_throttled(status_code):
+    return status_code == 429
+
+def is_server_error(status_code):
+    return 500 <= status_code < 600
+
+
+rate_limiter = RateLimiter()
@@ -4,17 +4,18 @@
 # - Have a list of failed songs
 # - Patch the front end into the backend
 # - Add a progress bar
-# - Add multi-threading
 import argparse
 import sys
-from apis.spotify import Spotify
-from apis.youtube import YouTube
 import utils
-import login
-import re
-from downloader import SpotifyDownloader
+import time
+from cache import MetadataCache, MatchCache
+from manifest import DownloadManifest
+from content_store import ContentStore
+from metrics import run_metrics
+from spotify_urls import ID_PATTERN, parse_spotify_url, is_private_playlist
+from exceptions import InvalidSpotifyURL
 
-from const import colours, SpotifyAuthType, DEFAULT_MIN_VIEWS_FOR_DOWNLOAD, DEFAULT_MAX_LENGTH_FOR_DOWNLOAD, LIKED_KEYWORD, HELP_URL
+from const import colours, SpotifyAuthType, DEFAULT_MIN_VIEWS_FOR_DOWNLOAD, DEFAULT_MAX_LENGTH_FOR_DOWNLOAD, DEFAULT_WORKER_COUNT, DEFAULT_QUEUE_SIZE, DEFAULT_METADATA_CACHE_TTL_DAYS, DEFAULT_OUTPUT_FORMAT, OUTPUT_FORMATS, DEFAULT_HTTP_TIMEOUT, DEFAULT_MAX_CONNECTIONS_PER_HOST, DEFAULT_MATCH_CACHE_TTL_DAYS, SPOTIFY_PAGE_CONCURRENCY, LIKED_KEYWORD, HELP_URL
 
 def get_bitrate_from_quality(quality):
     if quality == "low":
@@ -39,26 +40,104 @@ def validate_quality(quality):
     except ValueError:
         raise argparse.ArgumentTypeError(f"\nInvalid quality/bitrate: {quality}\n")
 
-def validate_spotify_url(url):
-    """Validate the Spotify URL and infer the type."""
-    song_pattern = r"https://open\.spotify\.com/track/[A-Za-z0-9?=\-]+"
-    playlist_pattern = r"https://open\.spotify\.com/playlist/[A-Za-z0-9?=\-]+"
-    private_playlist_pattern = r"https://open\.spotify\.com/playlist/[A-Za-z0-9?=[A-Za-z0-9&pt=[A-Za-z0-9\-]+"
-    album_pattern = r"https://open\.spotify\.com/album/[A-Za-z0-9?=\-]+"
+def validate_positive_int(name):
+    """An argparse type for an option taking a whole number of at least 1, whose errors name what the number is."""
+    def validate(value):
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"\nInvalid {name}: {value}\n")
+
+        if number < 1:
+            raise argparse.ArgumentTypeError(f"\n{name[0].upper() + name[1:]} must be at least 1: {value}\n")
+
+        return number
+
+    return validate
 
+validate_workers = validate_positive_int("worker count")
+
+def validate_spotify_url(url, kind=None):
+    """
+    Validate a Spotify URL, spotify: URI or (when the kind is known from the argument it was given to) bare ID,
+    and infer the type.
+    """
     if url == LIKED_KEYWORD:
         return url
-    elif re.match(song_pattern, url):
+
+    # the kind is only needed for bare IDs, a URL to something else is reported by main() against its argument
+    bare_id_kind = kind if ID_PATTERN.fullmatch(url.strip()) else None
+
+    try:
+        (url_kind, _) = parse_spotify_url(url, bare_id_kind)
+    except InvalidSpotifyURL:
+        print("")
+        raise ValueError(f"Invalid Spotify URL: {url}\n")
+
+    if url_kind == 'track':
         return 'song'
-    elif re.match(private_playlist_pattern, url):
+    elif is_private_playlist(url):
         return 'private_playlist'
-    elif re.match(playlist_pattern, url):
-        return 'playlist'
-    elif re.match(album_pattern, url):
-        return 'album'
     else:
-        print("")
-        raise ValueError(f"Invalid Spotify URL: {url}\n")
+        return url_kind
+
+def read_batch_file(batch_file):
+    """
+    Read the collections to download from a file with one Spotify URL or spotify: URI (or 'liked') per line, or from stdin
+    when the file is '-'. Blank lines and lines starting with # are ignored, and so is a collection that is already in the
+    file under another URL (e.g. with a ?si= share token, or as a spotify: URI).
+    """
+    if batch_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(batch_file, encoding="utf-8") as file:
+            lines = file.read().splitlines()
+
+    collections = []
+    seen_collections = set()
+
+    for (line_number, line) in enumerate(lines, 1):
+        url = line.strip()
+
+        if not url or url.startswith("#"):
+            continue
+
+        try:
+            url_type = validate_spotify_url(url)
+        except ValueError:
+            print(f"{colours.WARNING}Skipping line {line_number}, it is not a Spotify URL{colours.ENDC}: {url}")
+            continue
+
+        collection_key = url if url == LIKED_KEYWORD else parse_spotify_url(url)
+
+        if collection_key not in seen_collections:
+            seen_collections.add(collection_key)
+            collections.append((url_type, url))
+
+    return collections
+
+def manage_match_cache(action, ttl_days):
+    """Inspect or clean up the cache of YouTube videos that songs were matched to."""
+    match_cache = MatchCache(ttl=ttl_days * 24 * 60 * 60)
+
+    if action == "stats":
+        stats = match_cache.stats()
+        print(f"{colours.OKGREEN}Cached matches{colours.ENDC}: {stats['total']} ({stats['expired']} older than {ttl_days} days)")
+
+    elif action == "list":
+        now = time.time()
+        for (match_key, video_id, title, duration, views, resolved_at) in match_cache.entries():
+            age_days = (now - resolved_at) / (24 * 60 * 60)
+            expired = f" {colours.WARNING}[expired]{colours.ENDC}" if age_days > ttl_days else ""
+            print(f"{colours.OKCYAN}{match_key}{colours.ENDC} -> {video_id} {title} ({duration}s, {views} views, {age_days:.1f} days old){expired}")
+
+    elif action == "prune":
+        print(f"{colours.OKGREEN}Removed {match_cache.prune()} matches older than {ttl_days} days.{colours.ENDC}")
+
+    elif action == "clear":
+        print(f"{colours.OKGREEN}Removed {match_cache.clear()} cached matches.{colours.ENDC}")
+
+    match_cache.close()
 
 def get_user_input():
     """Prompt the user for input when no arguments are supplied."""
@@ -83,7 +162,7 @@ def get_user_input():
 
     return choice, url, quality, authtype
 
-def main(playlist=None, song=None, album=None, private_playlist=False, liked=False, quality=None, min_views=None, max_length=None, disable_threading=False):
+def main(playlist=None, song=None, album=None, private_playlist=False, liked=False, quality=None, min_views=None, max_length=None, disable_threading=False, workers=DEFAULT_WORKER_COUNT, stage_workers=None, queue_size=DEFAULT_QUEUE_SIZE, show_queue_depths=False, use_cache=True, cache_ttl_days=DEFAULT_METADATA_CACHE_TTL_DAYS, incremental=False, output_format=DEFAULT_OUTPUT_FORMAT, http_timeout=DEFAULT_HTTP_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS_PER_HOST, match_cache_ttl_days=DEFAULT_MATCH_CACHE_TTL_DAYS, batch_file=None, async_loading=False, show_timings=False, report_path=None):
     # Always use user authentication
     authtype = SpotifyAuthType.USER
 
@@ -91,12 +170,28 @@ def main(playlist=None, song=None, album=None, private_playlist=False, liked=Fal
     arg_name = 'song' if song else 'playlist' if playlist and not private_playlist else 'private_playlist' if playlist and private_playlist else 'album' if album else None
     url = song or playlist or album
 
-    if not (url or liked):
+    if not (url or liked or batch_file):
         print(f"{colours.FAIL}Error: You must specify a song, playlist, album, or '{LIKED_KEYWORD}' to download.{colours.ENDC}")
         parser.print_help()
         sys.exit(1)
     
-    url_type = validate_spotify_url(url) if url != None else LIKED_KEYWORD
+    url_kind = 'track' if song else 'playlist' if playlist else 'album' if album else None
+    url_type = validate_spotify_url(url, url_kind) if url != None else LIKED_KEYWORD
+
+    # read before logging in, so that a batch piped in on stdin is consumed before anything else reads it
+    collections = read_batch_file(batch_file) if batch_file else None
+
+    if batch_file and not collections:
+        print(f"{colours.FAIL}Error: No Spotify URLs found in {'stdin' if batch_file == '-' else batch_file}{colours.ENDC}")
+        sys.exit(1)
+
+    if incremental and not (liked or batch_file):
+        print(f"{colours.FAIL}Error: --incremental can only be used with --{LIKED_KEYWORD} or --from-file{colours.ENDC}")
+        sys.exit(1)
+
+    if incremental and not use_cache:
+        print(f"{colours.FAIL}Error: --incremental stores its progress in the metadata cache and can't be used with --no-cache{colours.ENDC}")
+        sys.exit(1)
     if url_type == 'private_playlist':
         private_playlist = True
 
@@ -104,6 +199,14 @@ def main(playlist=None, song=None, album=None, private_playlist=False, liked=Fal
         print(f"{colours.FAIL}Error: {arg_name} argument provided but value is a {url_type}{colours.ENDC}")
         sys.exit(1)
 
+    # imported only now, so that --help, --match-cache and mistyped arguments don't wait for tekore, pytubefix
+    # and the HTTP clients to load
+    import login
+    from apis.spotify import Spotify
+    from apis.youtube import YouTube
+    from downloader import SpotifyDownloader
+    from transport import transport
+
     # Login if needed
     if not login.is_user_logged_in():
         login.do_user_login()
@@ -122,13 +225,22 @@ def main(playlist=None, song=None, album=None, private_playlist=False, liked=Fal
     if album:
         print(f"{colours.OKGREEN}Album{colours.ENDC}: {album}")
 
+    if collections:
+        print(f"{colours.OKGREEN}Batch{colours.ENDC}: {len(collections)} collections from {'stdin' if batch_file == '-' else batch_file}")
+
     if liked:
         print(f"{colours.OKGREEN}Liked Songs{colours.ENDC}")
+
+        if incremental:
+            print(f"{colours.OKGREEN}Only songs liked since the last sync{colours.ENDC}")
     
     if quality:
         bitrate = get_bitrate_from_quality(quality)
         print(f"{colours.OKGREEN}Song quality / bitrate{colours.ENDC}: {quality} / {bitrate} bps")
 
+    if output_format != DEFAULT_OUTPUT_FORMAT:
+        print(f"{colours.OKGREEN}Output format{colours.ENDC}: {output_format} (copied without re-encoding when YouTube has a matching stream)")
+
     if min_views != DEFAULT_MIN_VIEWS_FOR_DOWNLOAD:
         print(f"{colours.OKGREEN}Minimum view count{colours.ENDC}: {min_views}")
 
@@ -138,12 +250,44 @@ def main(playlist=None, song=None, album=None, private_playlist=False, liked=Fal
     print(f"{colours.OKGREEN}Accessing Spotify as logged in user {colours.ENDC}")
     
     if disable_threading:
+        workers = 1
         print(f"{colours.WARNING}Threading is disabled. Downloads may be slower.{colours.ENDC}")
+    else:
+        print(f"{colours.OKGREEN}Download workers{colours.ENDC}: {workers}")
+
+        for stage, stage_worker_count in (stage_workers or {}).items():
+            if stage_worker_count:
+                print(f"{colours.OKGREEN}{stage.capitalize()} workers{colours.ENDC}: {stage_worker_count}")
+
+    if not use_cache:
+        print(f"{colours.WARNING}Metadata cache is disabled. All metadata will be fetched from Spotify.{colours.ENDC}")
+    elif cache_ttl_days != DEFAULT_METADATA_CACHE_TTL_DAYS:
+        print(f"{colours.OKGREEN}Metadata cache lifetime{colours.ENDC}: {cache_ttl_days} days")
 
-    spotify = Spotify(authtype)
-    youtube = YouTube()
+    if http_timeout != DEFAULT_HTTP_TIMEOUT:
+        print(f"{colours.OKGREEN}HTTP timeout{colours.ENDC}: {http_timeout}s")
 
-    downloader = SpotifyDownloader(spotify, youtube, get_bitrate_from_quality(quality), max_length, min_views)
+    if max_connections != DEFAULT_MAX_CONNECTIONS_PER_HOST:
+        print(f"{colours.OKGREEN}Connections per host{colours.ENDC}: {max_connections}")
+
+    if async_loading:
+        print(f"{colours.OKGREEN}Async loading{colours.ENDC}: up to {SPOTIFY_PAGE_CONCURRENCY} pages at a time")
+
+    transport.configure(max_connections, http_timeout)
+
+    metadata_cache = MetadataCache(ttl=cache_ttl_days * 24 * 60 * 60) if use_cache else None
+    match_cache = MatchCache(ttl=match_cache_ttl_days * 24 * 60 * 60) if use_cache else None
+
+    spotify = Spotify(authtype, metadata_cache, async_loading)
+    youtube = YouTube(match_cache)
+
+    manifest = DownloadManifest()
+    content_store = ContentStore(manifest)
+
+    downloader = SpotifyDownloader(spotify, youtube, get_bitrate_from_quality(quality), max_length, min_views, workers, stage_workers, queue_size, show_queue_depths, manifest, output_format, content_store)
+
+    # every track's measurements are only kept when they're shown or reported
+    run_metrics.keep_tracks = bool(show_timings or report_path)
 
     success = False
 
@@ -154,10 +298,32 @@ def main(playlist=None, song=None, album=None, private_playlist=False, liked=Fal
     elif(album):
         success = downloader.download_album(album)
     elif(liked):
-        success = downloader.download_liked_songs()
+        success = downloader.download_liked_songs(incremental)
+    elif(collections):
+        success = downloader.download_batch(collections, incremental)
 
     downloader.rm_tmp_folder()
 
+    match_stats = youtube.format_match_stats()
+    if match_stats:
+        print(f"\n{colours.OKGREEN}YouTube matches{colours.ENDC}: {match_stats}")
+
+    if show_timings or report_path:
+        print(f"\n{colours.OKGREEN}Time spent on each track{colours.ENDC}\n{run_metrics.format_summary()}")
+
+    if report_path:
+        run_metrics.write_report(report_path)
+        print(f"\n{colours.OKGREEN}Run report{colours.ENDC}: {report_path}")
+
+    manifest.close()
+    transport.close()
+
+    if metadata_cache:
+        metadata_cache.close()
+
+    if match_cache:
+        match_cache.close()
+
     if(success):
         print(f"\n{colours.OKGREEN}Download complete!{colours.ENDC} (check downloads folder)\n")
     else:
@@ -169,20 +335,47 @@ if __name__ == "__main__":
 
         parser = argparse.ArgumentParser(description="spotify2mp3: Download songs from Spotify by searching them on YouTube and converting the audio.")
         group = parser.add_mutually_exclusive_group(required=True)
-        group.add_argument("-p", "--playlist", "--list", help="Specify a playlist URL or ID to download. Private playlists must be placed in quotes '<playlist_url>' ", type=str)
-        group.add_argument("-s", "--song", "--single", "-t", "--track", help="Specify a song URL or ID to download", type=str)
-        group.add_argument("-a", "--album", help="Specify an album URL or ID to download", type=str)
+        group.add_argument("-p", "--playlist", "--list", help="Specify a playlist URL, spotify: URI or ID to download. Private playlists must be placed in quotes '<playlist_url>' ", type=str)
+        group.add_argument("-s", "--song", "--single", "-t", "--track", help="Specify a song URL, spotify: URI or ID to download", type=str)
+        group.add_argument("-a", "--album", help="Specify an album URL, spotify: URI or ID to download", type=str)
         group.add_argument("-l", f"--{LIKED_KEYWORD}", help=f"Retrieves user's {LIKED_KEYWORD} songs", action="store_true")
+        group.add_argument("--from-file", help=f"Download every Spotify URL or spotify: URI (or '{LIKED_KEYWORD}') listed in a file, one per line, in a single run. Use - to read them from stdin", metavar="FILE")
+        group.add_argument("--match-cache", help="Show, list, prune (drop expired entries) or clear the cache of YouTube matches, then exit", choices=["stats", "list", "prune", "clear"])
 
         parser.add_argument("-q", "--quality", help="Specify the song download quality or bitrate", type=validate_quality, default="high")
+        parser.add_argument("-f", "--format", help="Output audio format. m4a and opus skip re-encoding when YouTube has a stream in that codec", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT)
         parser.add_argument("--min-views", help="Minimum view count on YouTube", type=int, default=DEFAULT_MIN_VIEWS_FOR_DOWNLOAD)
         parser.add_argument("--max-length", help="Maximum video length on YouTube in minutes", type=int, default=DEFAULT_MAX_LENGTH_FOR_DOWNLOAD)
         parser.add_argument("--disable-threading", help="Disables multiple threads to download songs.", action="store_true")
+        parser.add_argument("-w", "--workers", help="Number of songs to download at the same time", type=validate_workers, default=DEFAULT_WORKER_COUNT)
+        parser.add_argument("--search-workers", help="Number of songs searched for on YouTube at the same time (defaults to --workers)", type=validate_workers)
+        parser.add_argument("--fetch-workers", help="Number of songs downloaded from YouTube at the same time (defaults to --workers)", type=validate_workers)
+        parser.add_argument("--transcode-workers", help="Number of songs converted at the same time (defaults to --workers, at most one per CPU core)", type=validate_workers)
+        parser.add_argument("--tag-workers", help="Number of songs tagged at the same time (defaults to 1)", type=validate_workers)
+        parser.add_argument("--queue-size", help="Number of songs that can wait between each download stage", type=validate_positive_int("queue size"), default=DEFAULT_QUEUE_SIZE)
+        parser.add_argument("--timings", help="Print how long each download stage took per song (median, 90th and 99th percentile) at the end of the run", action="store_true")
+        parser.add_argument("--report", help="Write the time, bytes and retries of every song in every stage to a JSON file, or a CSV file if the name ends in .csv", metavar="FILE")
+        parser.add_argument("--show-queues", help="Print how many songs are waiting in each download stage", action="store_true")
+        parser.add_argument("--http-timeout", help="Seconds to wait for Spotify, YouTube and cover art servers before giving up on a request", type=float, default=DEFAULT_HTTP_TIMEOUT)
+        parser.add_argument("--async-loading", help="Fetch the pages of large playlists, albums and liked songs concurrently instead of one after another", action="store_true")
+        parser.add_argument("--max-connections", help="Maximum number of open connections to each server", type=validate_positive_int("connection count"), default=DEFAULT_MAX_CONNECTIONS_PER_HOST)
+        parser.add_argument("--incremental", help=f"Only download songs liked since the last incremental run of --{LIKED_KEYWORD} (or of a --from-file batch listing '{LIKED_KEYWORD}')", action="store_true")
+        parser.add_argument("--no-cache", help="Do not read or write the local Spotify metadata and YouTube match caches", action="store_true")
+        parser.add_argument("--match-cache-ttl", help="Number of days a song's YouTube match is reused before searching again", type=float, default=DEFAULT_MATCH_CACHE_TTL_DAYS)
+        parser.add_argument("--cache-ttl", help="Number of days cached album and track metadata is trusted for", type=float, default=DEFAULT_METADATA_CACHE_TTL_DAYS)
         # Remove login argument as it's now always required
 
         args = parser.parse_args()
 
-        main(playlist=args.playlist, song=args.song, album=args.album, liked=args.liked, quality=args.quality, min_views=args.min_views, max_length=args.max_length, disable_threading=args.disable_threading)
+        if args.match_cache:
+            manage_match_cache(args.match_cache, args.match_cache_ttl)
+            sys.exit(0)
+
+        main(playlist=args.playlist, song=args.song, album=args.album, liked=args.liked, quality=args.quality, min_views=args.min_views, max_length=args.max_length, disable_threading=args.disable_threading, workers=args.workers,
+             stage_workers={"search": args.search_workers, "fetch": args.fetch_workers, "transcode": args.transcode_workers, "tag": args.tag_workers},
+             queue_size=args.queue_size, show_queue_depths=args.show_queues, use_cache=not args.no_cache, cache_ttl_days=args.cache_ttl, incremental=args.incremental, output_format=args.format,
+             http_timeout=args.http_timeout, max_connections=args.max_connections, match_cache_ttl_days=args.match_cache_ttl, batch_file=args.from_file, async_loading=args.async_loading,
+             show_timings=args.timings, report_path=args.report)
 
     else:  # If no command-line arguments are provided, use wizard mode.
         utils.print_splash_screen()
@@ -0,0 +1,61 @@
+import re
+
+import const
+from exceptions import InvalidSpotifyURL
+
+
+RESOURCE_KINDS = ("track", "album", "playlist")
+
+# https://open.spotify.com/track/<id>?si=..., including the localised /intl-xx/ links the share menu produces
+URL_PATTERN = re.compile(r"https?://(?:open|play)\.spotify\.com/(?:intl-[A-Za-z-]+/)?(track|album|playlist)/([A-Za-z0-9]+)/?(?:\?([^#]*))?(?:#.*)?")
+URI_PATTERN = re.compile(r"spotify:(track|album|playlist):([A-Za-z0-9]+)")
+ID_PATTERN = re.compile(r"[A-Za-z0-9]{22}")
+
+# private playlists are shared with a pt= token next to the usual si= one
+PRIVATE_TOKEN_PATTERN = re.compile(r"(?:^|&)pt=")
+
+
+class PathCharacterTable(dict):
+    """str.translate() table that keeps the legal path characters and drops every other character."""
+    def __init__(self, legal_characters):
+        super().__init__((ord(character), ord(character)) for character in legal_characters)
+
+    def __missing__(self, code_point):
+        self[code_point] = None
+        return None
+
+
+PATH_CHARACTER_TABLE = PathCharacterTable(const.LEGAL_PATH_CHARACTERS)
+
+
+def parse_spotify_url(value, kind=None):
+    """
+    Return the (kind, resource ID) of an open.spotify.com URL, a spotify:kind:id URI or a bare ID. A bare ID
+    carries no kind, so it is only accepted when the caller says what it expects. Raises InvalidSpotifyURL.
+    """
+    value = value.strip()
+
+    match = URL_PATTERN.fullmatch(value) or URI_PATTERN.fullmatch(value)
+
+    if match:
+        (found_kind, resource_id) = match.group(1, 2)
+    elif kind and ID_PATTERN.fullmatch(value):
+        (found_kind, resource_id) = (kind, value)
+    else:
+        raise InvalidSpotifyURL(f"Invalid Spotify {kind or 'URL'}: {value}")
+
+    if kind and found_kind != kind:
+        raise InvalidSpotifyURL(f"Expected a Spotify {kind} link, got: {value}")
+
+    return found_kind, resource_id
+
+def is_private_playlist(value):
+    match = URL_PATTERN.fullmatch(value.strip())
+    return bool(match and match.group(1) == "playlist" and match.group(3) and PRIVATE_TOKEN_PATTERN.search(match.group(3)))
+
+def resource_url(kind, resource_id):
+    return f"https://open.spotify.com/{kind}/{resource_id}"
+
+def sanitize_filename(text):
+    """Drop every character that isn't in LEGAL_PATH_CHARACTERS, for use in file and folder names."""
+    return text.translate(PATH_CHARACTER_TABLE)
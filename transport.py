@@ -0,0 +1,190 @@
+import asyncio
+import ssl
+import threading
+import time
+
+import certifi
+import httpx
+import requests
+import tekore as tk
+from requests.adapters import HTTPAdapter
+
+import const
+from metrics import run_metrics
+from ratelimit import rate_limiter, backoff_delay, is_throttled, is_server_error
+
+
+class LimitedSession(requests.Session):
+    """
+    A requests session that applies a default timeout to every request that doesn't set one, and sends
+    requests through the shared rate limiter, retrying 429s and server errors with backoff.
+    """
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(const.RATE_LIMIT_MAX_RETRIES + 1):
+            rate_limiter.acquire(url)
+            response = super().request(method, url, **kwargs)
+
+            if attempt == const.RATE_LIMIT_MAX_RETRIES:
+                break
+
+            if is_throttled(response.status_code):
+                rate_limiter.throttled(url, attempt, response.headers.get("Retry-After"))
+            elif is_server_error(response.status_code):
+                time.sleep(backoff_delay(attempt))
+            else:
+                rate_limiter.succeeded(url)
+                break
+
+            run_metrics.add_retry()
+            response.close()
+
+        # streamed responses are counted by whoever reads them
+        if not kwargs.get("stream"):
+            run_metrics.add_bytes(len(response.content))
+
+        return response
+
+
+class RateLimitedSender(tk.ExtendingSender):
+    """
+    tekore sender that waits for the shared rate limiter before each Spotify request, and retries 429s
+    (for as long as Retry-After says) and server errors with backoff. Works with sync and async senders.
+    """
+    def send(self, request):
+        if self.is_async:
+            return self.async_send(request)
+
+        for attempt in range(const.RATE_LIMIT_MAX_RETRIES + 1):
+            rate_limiter.acquire(request.url)
+            response = self.sender.send(request)
+
+            delay = self.retry_delay(request, response, attempt)
+            if delay is None:
+                return response
+
+            run_metrics.add_retry()
+            time.sleep(delay)
+
+        return response
+
+    async def async_send(self, request):
+        for attempt in range(const.RATE_LIMIT_MAX_RETRIES + 1):
+            await asyncio.sleep(rate_limiter.reserve(request.url))
+            response = await self.sender.send(request)
+
+            delay = self.retry_delay(request, response, attempt)
+            if delay is None:
+                return response
+
+            run_metrics.add_retry()
+            await asyncio.sleep(delay)
+
+        return response
+
+    def retry_delay(self, request, response, attempt):
+        """Seconds to wait before sending the request again, or None if the response should be returned."""
+        if attempt == const.RATE_LIMIT_MAX_RETRIES:
+            return None
+
+        if is_throttled(response.status_code):
+            # the pause is taken care of by the next reservation, which every other worker waits on too
+            rate_limiter.throttled(request.url, attempt, response.headers.get("Retry-After"))
+            return 0
+
+        if is_server_error(response.status_code):
+            return backoff_delay(attempt)
+
+        rate_limiter.succeeded(request.url)
+        return None
+
+
+class Transport():
+    """
+    The HTTP connections shared by every client in the process: one pooled requests session for YouTube
+    search, stream downloads and cover art, and one pooled httpx client for tekore's Spotify calls.
+    Connections are kept alive between requests, so a long run doesn't pay for a TLS handshake per track,
+    and both go through the same per host rate limiter.
+    """
+    def __init__(self, max_connections_per_host=const.DEFAULT_MAX_CONNECTIONS_PER_HOST, timeout=const.DEFAULT_HTTP_TIMEOUT):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.requests_session = None
+        self.httpx_client = None
+        self.lock = threading.Lock()
+
+    def configure(self, max_connections_per_host=None, timeout=None):
+        """Change the pool size and timeout. Has to be called before the first request is made."""
+        if max_connections_per_host is not None:
+            self.max_connections_per_host = max_connections_per_host
+        if timeout is not None:
+            self.timeout = timeout
+
+    def session(self):
+        with self.lock:
+            if self.requests_session is None:
+                # pool_block makes threads wait for a free connection instead of opening more than the per host limit
+                adapter = HTTPAdapter(pool_connections=const.HTTP_POOL_HOSTS, pool_maxsize=self.max_connections_per_host, pool_block=True)
+
+                self.requests_session = LimitedSession(self.timeout)
+                self.requests_session.verify = certifi.where()
+                self.requests_session.mount("https://", adapter)
+                self.requests_session.mount("http://", adapter)
+
+            return self.requests_session
+
+    def spotify_client(self):
+        with self.lock:
+            if self.httpx_client is None:
+                # tekore only talks to api.spotify.com and accounts.spotify.com
+                self.httpx_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=self.max_connections_per_host * 2, max_keepalive_connections=self.max_connections_per_host * 2),
+                    timeout=self.timeout,
+                    verify=ssl.create_default_context(cafile=certifi.where()),
+                )
+
+            return self.httpx_client
+
+    def spotify_sender(self):
+        return RateLimitedSender(tk.SyncSender(client=self.spotify_client()))
+
+    def async_spotify_client(self):
+        """
+        A new httpx client for tekore's async sender. An async client belongs to the event loop it's used in, so
+        unlike the others it isn't shared and the caller closes it (e.g. with async with).
+        """
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections_per_host * 2, max_keepalive_connections=self.max_connections_per_host * 2),
+            timeout=self.timeout,
+            verify=ssl.create_default_context(cafile=certifi.where()),
+        )
+
+    def async_spotify_sender(self, client):
+        return RateLimitedSender(tk.AsyncSender(client=client))
+
+    def close(self):
+        with self.lock:
+            if self.requests_session is not None:
+                self.requests_session.close()
+                self.requests_session = None
+
+            if self.httpx_client is not None:
+                self.httpx_client.close()
+                self.httpx_client = None
+
+
+def use_certifi_for_urllib():
+    """
+    pytubefix makes its requests through urllib and can't be given an SSL context, so point urllib's default
+    context at certifi's CA bundle. This fixes missing system certificates without switching off verification.
+    """
+    ssl._create_default_https_context = lambda: ssl.create_default_context(cafile=certifi.where())
+
+
+transport = Transport()
+use_certifi_for_urllib()
@@ -1,17 +1,17 @@
-from const import colours, BASE62
-import logging
+from const import colours, BASE62, PARTIAL_FILE_SUFFIX, PASSTHROUGH_SOURCE_EXTENSIONS
 import string
 import sys
 import random
-import eyed3
-from eyed3.id3.frames import ImageFrame
-import moviepy.editor as mp
-from moviepy.editor import *
-import requests
+import base64
 import shutil
+import subprocess
 import os
 
-logging.getLogger('moviepy').setLevel(logging.CRITICAL)
+from exceptions import TranscodeError
+from cover_art import CoverArtCache, image_mime_type
+from metrics import run_metrics
+
+cover_art_cache = CoverArtCache()
 
 
 def print_splash_screen():
@@ -35,22 +35,124 @@ def random_string(length=10):
     letters = string.ascii_letters  # This includes both lowercase and uppercase letters.
     return ''.join(random.choice(letters) for i in range(length))
 
-def resave_audio_clip_with_metadata(audio_input_path, song_metadata, song_output_path, audio_quality):
-
-    temporary_audio_path = "./temp/" + random_string(20) + ".mp3"
-
-    clip = AudioFileClip(audio_input_path)
-    clip.write_audiofile(temporary_audio_path, logger=None, bitrate=f'{audio_quality}k')
-
-    audiofile = eyed3.load(temporary_audio_path)
+def partial_path_for(output_path):
+    """
+    Return a hidden temporary path next to output_path. Files are written there and then moved into place
+    with os.replace, which is atomic within a directory, so output_path never holds a half-written file.
+    """
+    (folder, file_name) = os.path.split(output_path)
+    (_, extension) = os.path.splitext(file_name)
+
+    return os.path.join(folder, "." + random_string(20) + PARTIAL_FILE_SUFFIX + extension)
+
+def remove_partial_files(folder):
+    """Remove temporary files left in a folder by a run that was interrupted."""
+    if not os.path.isdir(folder):
+        return
+
+    for file_name in os.listdir(folder):
+        (name, _) = os.path.splitext(file_name)
+        if file_name.startswith(".") and name.endswith(PARTIAL_FILE_SUFFIX):
+            os.remove(os.path.join(folder, file_name))
+
+def link_file(source_path, link_path):
+    """
+    Put a finished file at a second path without storing it twice: a hard link where the file system
+    supports one, a relative symlink where it doesn't (e.g. across drives), and a copy as a last resort.
+    Like every other output it is moved into place atomically.
+    """
+    partial_path = partial_path_for(link_path)
+
+    try:
+        os.link(source_path, partial_path)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(source_path, os.path.dirname(os.path.abspath(link_path))), partial_path)
+        except OSError:
+            shutil.copy2(source_path, partial_path)
+
+    os.replace(partial_path, link_path)
+
+# ffmpeg encoder and container for each output format
+OUTPUT_FORMAT_ENCODERS = {
+    "mp3": ("libmp3lame", "mp3"),
+    "m4a": ("aac", "mp4"),
+    "opus": ("libopus", "ogg"),
+}
+
+def can_passthrough(audio_input_path, output_format):
+    """Whether a downloaded stream already holds audio in the codec of output_format, so it only needs remuxing."""
+    (_, extension) = os.path.splitext(audio_input_path)
+    return extension.lstrip(".").lower() in PASSTHROUGH_SOURCE_EXTENSIONS.get(output_format, ())
+
+def transcode_audio_clip(audio_input_path, audio_output_path, audio_quality, output_format="mp3"):
+    """
+    Convert a downloaded stream to output_format at audio_quality bits per second with a single ffmpeg process.
+    Streams that are already in the right codec are copied into the new container without re-encoding.
+    """
+    import imageio_ffmpeg
+
+    (encoder, container) = OUTPUT_FORMAT_ENCODERS[output_format]
+
+    if can_passthrough(audio_input_path, output_format):
+        codec_arguments = ["-codec:a", "copy"]
+    else:
+        codec_arguments = ["-codec:a", encoder, "-b:a", str(audio_quality)]
+
+    command = [
+        imageio_ffmpeg.get_ffmpeg_exe(),
+        "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+        "-i", audio_input_path,
+        "-vn", "-map_metadata", "-1",
+        *codec_arguments,
+        "-f", container, audio_output_path,
+    ]
+
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    if result.returncode != 0:
+        raise TranscodeError(f"ffmpeg exited with code {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+
+def fetch_cover_art(image_url):
+    with run_metrics.measure_nested("cover_art"):
+        return cover_art_cache.get(image_url)
+
+def write_audio_metadata(audio_path, song_metadata, output_format="mp3"):
+    TAG_WRITERS[output_format](audio_path, song_metadata)
+
+def read_audio_info(audio_path):
+    """
+    The title tag (None without one), length in seconds and bitrate of an audio file in any of the output formats,
+    or None if it can't be read.
+    """
+    import mutagen
+
+    try:
+        audiofile = mutagen.File(audio_path, easy=True)
+    except mutagen.MutagenError:
+        return None
+
+    if audiofile is None or not audiofile.info.length:
+        return None
+
+    titles = audiofile.get("title") if audiofile.tags is not None else None
+
+    return titles[0] if titles else None, audiofile.info.length, getattr(audiofile.info, "bitrate", 0)
+
+# the tagging libraries are imported by the writer for each format, so only the one in use is ever loaded
+def write_mp3_metadata(audio_path, song_metadata):
+    import eyed3
+    from eyed3.id3.frames import ImageFrame
+
+    audiofile = eyed3.load(audio_path)
 
     if audiofile.tag is None:
         audiofile.initTag()
 
     # Setting album cover from the provided image_url
     image_url = song_metadata['image_url']
-    image_data = requests.get(image_url).content
-    audiofile.tag.images.set(ImageFrame.FRONT_COVER, image_data, 'image/jpeg', "Cover Image from Spotify")
+    image_data = fetch_cover_art(image_url)
+    audiofile.tag.images.set(ImageFrame.FRONT_COVER, image_data, image_mime_type(image_data), "Cover Image from Spotify")
 
     # Setting title, artist, and album details
     audiofile.tag.title = song_metadata['title']            
@@ -63,7 +165,50 @@ def resave_audio_clip_with_metadata(audio_input_path, song_metadata, song_output
 
     audiofile.tag.save()
 
-    shutil.copy(temporary_audio_path, song_output_path)
+def write_m4a_metadata(audio_path, song_metadata):
+    from mutagen.mp4 import MP4, MP4Cover
+
+    audiofile = MP4(audio_path)
+
+    if audiofile.tags is None:
+        audiofile.add_tags()
+
+    image_data = fetch_cover_art(song_metadata['image_url'])
+    image_format = MP4Cover.FORMAT_PNG if image_mime_type(image_data) == 'image/png' else MP4Cover.FORMAT_JPEG
+    audiofile.tags['covr'] = [MP4Cover(image_data, imageformat=image_format)]
+
+    audiofile.tags['\xa9nam'] = [song_metadata['title']]
+    audiofile.tags['\xa9ART'] = [", ".join(song_metadata['artist'])]
+    audiofile.tags['\xa9alb'] = [song_metadata['album']]
+    audiofile.tags['trkn'] = [(song_metadata['track_num'], 0)]
+    audiofile.tags['\xa9day'] = [song_metadata['release_date'][:4]]
+
+    audiofile.save()
+
+def write_opus_metadata(audio_path, song_metadata):
+    from mutagen.flac import Picture
+    from mutagen.oggopus import OggOpus
+
+    audiofile = OggOpus(audio_path)
+
+    # Vorbis comments carry cover art as a base64 encoded FLAC picture block
+    picture = Picture()
+    picture.type = 3  # front cover
+    picture.data = fetch_cover_art(song_metadata['image_url'])
+    picture.mime = image_mime_type(picture.data)
+    picture.desc = "Cover Image from Spotify"
+    audiofile['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+
+    audiofile['title'] = [song_metadata['title']]
+    audiofile['artist'] = [", ".join(song_metadata['artist'])]
+    audiofile['album'] = [song_metadata['album']]
+    audiofile['tracknumber'] = [str(song_metadata['track_num'])]
+    audiofile['date'] = [song_metadata['release_date'][:4]]
+
+    audiofile.save()
 
-    # Remove the temporary file
-    os.remove(temporary_audio_path)   # changed from shutil.rmtree which deletes directories
+TAG_WRITERS = {
+    "mp3": write_mp3_metadata,
+    "m4a": write_m4a_metadata,
+    "opus": write_opus_metadata,
+}